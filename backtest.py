@@ -0,0 +1,165 @@
+"""Portfolio backtest of model scores: every quarter go long the top and short the bottom quantile of the
+scored stocks (equal weights), hold for one quarter, w/ turnover and transaction costs
+
+Everything runs on dense run x quarter x ticker arrays, w/o a loop over dates, so the predictions
+of thousands of sweep trials or walk-forward folds (one column each) are evaluated in a few passes."""
+
+import numpy as np
+import pandas as pd
+
+from feature_engine import dense_layout, forward_returns, pct_rank_rows
+
+# score columns (runs) evaluated together, bounds the run x quarter x ticker arrays
+BATCH_RUNS = 16
+
+# quarters per year, to annualize
+PERIODS = 4
+
+LEGS = ['long', 'short', 'long_short', 'turnover', 'cost', 'net']
+
+
+def quarter_dates_of(index, q_codes, n_quarters):
+    """Date of every quarter offset of the dense grid (NaT for quarters w/o rows)"""
+    dates = np.full(n_quarters, np.datetime64('NaT'), dtype='datetime64[ns]')
+    dates[q_codes] = index.get_level_values('date').values
+    return dates
+
+
+def portfolio_weights(scores, quantile):
+    """Long and short weights (runs x quarters x tickers) of the top / bottom quantile of every quarter's scores, equal weighted"""
+    lo, hi = (quantile, 1 - quantile) if np.isscalar(quantile) else quantile
+    shape = scores.shape
+    ranks = pct_rank_rows(scores.reshape(-1, shape[-1])).reshape(shape)
+    with np.errstate(invalid='ignore'):
+        legs = [ranks > hi, ranks <= lo]
+    weights = []
+    for leg in legs:
+        n = leg.sum(axis=-1, keepdims=True)
+        weights.append(np.where(leg, 1.0 / np.maximum(n, 1), 0.0))
+    return weights
+
+
+def leg_turnover(weights, returns, leg_returns):
+    """One-way turnover of every quarter: half the traded notional |target weights - last quarter's weights
+    after drifting w/ their returns| (a full rebalance of a leg is 1)"""
+    drifted = np.zeros_like(weights)
+    growth = 1 + leg_returns[:, :-1, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drifted[:, 1:] = np.where(growth > 0, weights[:, :-1] * (1 + returns[:-1]) / growth, 0.0)
+    return np.abs(weights - drifted).sum(axis=-1) / 2
+
+
+def backtest_grid(scores, fwd, quantile=0.1, cost_bps=10.0):
+    """Backtest of (runs x quarters x tickers) scores w/ (quarters x tickers) forward returns : {leg: runs x quarters array}
+
+    A missing forward return (delisted, missing quarter) counts as 0, the position is marked flat"""
+    returns = np.where(np.isfinite(fwd), fwd, 0.0)
+    w_long, w_short = portfolio_weights(scores, quantile)
+    long_ret = (w_long * returns).sum(axis=-1)
+    short_ret = (w_short * returns).sum(axis=-1)
+    turnover = leg_turnover(w_long, returns, long_ret) + leg_turnover(w_short, returns, short_ret)
+    # every unit bought or sold pays cost_bps: the traded notional is twice the one-way turnover
+    cost = 2 * turnover * cost_bps / 1e4
+    return {'long': long_ret, 'short': short_ret, 'long_short': long_ret - short_ret,
+            'turnover': turnover, 'cost': cost, 'net': long_ret - short_ret - cost,
+            'n_long': (w_long > 0).sum(axis=-1), 'n_short': (w_short > 0).sum(axis=-1)}
+
+
+def summarize(legs, active, hits=None):
+    """Per run statistics of the net long/short returns over the active quarters"""
+    net = np.where(active, legs['net'], 0.0)
+    n = active.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = net.sum(axis=1) / n
+        std = np.sqrt(((net - mean[:, None]) ** 2 * active).sum(axis=1) / (n - 1))
+        wealth = np.cumprod(1 + net, axis=1)
+        drawdown = wealth / np.maximum.accumulate(wealth, axis=1) - 1
+        summary = {'quarters': n,
+                   'mean_net': mean,
+                   'ann_return': wealth[:, -1] ** (PERIODS / n) - 1,
+                   'ann_vol': std * np.sqrt(PERIODS),
+                   'sharpe': mean / std * np.sqrt(PERIODS),
+                   'max_drawdown': drawdown.min(axis=1),
+                   'mean_long': np.where(active, legs['long'], 0).sum(axis=1) / n,
+                   'mean_short': np.where(active, legs['short'], 0).sum(axis=1) / n,
+                   'turnover': np.where(active, legs['turnover'], 0).sum(axis=1) / n,
+                   'cost': np.where(active, legs['cost'], 0).sum(axis=1) / n}
+    if hits is not None:
+        summary.update(hits)
+    return summary
+
+
+def label_hits(weights, labels):
+    """Share of the long picks labelled 1 and of the short picks labelled 0 (see make_labels), per run"""
+    w_long, w_short = weights
+    known = ~np.isnan(labels)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {'hit_long': ((w_long > 0) & (labels == 1)).sum(axis=(1, 2)) / ((w_long > 0) & known).sum(axis=(1, 2)),
+                'hit_short': ((w_short > 0) & (labels == 0)).sum(axis=(1, 2)) / ((w_short > 0) & known).sum(axis=(1, 2))}
+
+
+def backtest(scores, prices, quantile=0.1, cost_bps=10.0, labels=None, batch_runs=BATCH_RUNS):
+    """Backtest model scores (series, or frame w/ one column per run, indexed by (tic, date)) on quarterly long/short portfolios
+
+    prices   : prccq indexed by (tic, date) over the full history (e.g. df1['prccq']), the
+               portfolios of quarter t earn the return from t to t+1
+    quantile : q for the top q / bottom q of the scored stocks, or (lo, hi) rank thresholds
+    cost_bps : transaction cost per unit traded (buys + sells), in basis points
+    labels   : optional binary outperformance labels (see make_labels) to report the hit rate of the picks
+
+    Returns the per run summary (net return, sharpe, drawdown, turnover, costs, hit rates) and the
+    per quarter returns w/ columns (run, leg)"""
+    if isinstance(scores, pd.Series):
+        scores = scores.to_frame(scores.name if scores.name is not None else 'score')
+    tic_codes, q_codes, (n_tics, n_quarters) = dense_layout(prices.index)
+    fwd = forward_returns(prices, 1)[0].T
+    dates = quarter_dates_of(prices.index, q_codes, n_quarters)
+
+    # rows of the scores (and labels) on the price grid, rows w/o a price are left out
+    pos = prices.index.get_indexer(scores.index)
+    found = pos >= 0
+    rows, score_q, score_t = np.flatnonzero(found), q_codes[pos[found]], tic_codes[pos[found]]
+    label_grid = None
+    if labels is not None:
+        label_grid = np.full((n_quarters, n_tics), np.nan)
+        label_pos = prices.index.get_indexer(labels.index)
+        label_grid[q_codes[label_pos[label_pos >= 0]], tic_codes[label_pos[label_pos >= 0]]] = \
+            np.asarray(labels, dtype=float)[label_pos >= 0]
+
+    # a quarter counts if it has both legs and a known forward return
+    known_fwd = np.isfinite(fwd).any(axis=1)
+    summaries, returns = [], []
+    values = scores.to_numpy(dtype=float)
+    for start in range(0, values.shape[1], batch_runs):
+        runs = list(scores.columns[start:start + batch_runs])
+        grid = np.full((len(runs), n_quarters, n_tics), np.nan)
+        grid[:, score_q, score_t] = values[rows, start:start + len(runs)].T
+        legs = backtest_grid(grid, fwd, quantile, cost_bps)
+        active = (legs['n_long'] > 0) & (legs['n_short'] > 0) & known_fwd
+        hits = None if label_grid is None else label_hits(portfolio_weights(grid, quantile), label_grid)
+        summaries.append(pd.DataFrame(summarize(legs, active, hits), index=pd.Index(runs, name='run')))
+        columns = pd.MultiIndex.from_product([runs, LEGS], names=['run', 'leg'])
+        per_quarter = np.stack([np.where(active, legs[leg], np.nan) for leg in LEGS], axis=-1)
+        returns.append(pd.DataFrame(per_quarter.transpose(1, 0, 2).reshape(n_quarters, -1),
+                                    index=pd.DatetimeIndex(dates, name='date'), columns=columns))
+    returns = pd.concat(returns, axis='columns')
+    return pd.concat(summaries), returns[returns.notna().any(axis=1) & returns.index.notna()]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from data_cache import load_prepared
+    from feature_engine import make_labels
+
+    parser = argparse.ArgumentParser(description='long/short backtest of model scores on a compustat export')
+    parser.add_argument('scores', help='csv w/ tic, date and one score column per run')
+    parser.add_argument('filename', help='compustat export the prices come from')
+    parser.add_argument('--quantile', type=float, default=0.1)
+    parser.add_argument('--cost-bps', type=float, default=10.0)
+    args = parser.parse_args()
+
+    scores = pd.read_csv(args.scores, parse_dates=['date']).set_index(['tic', 'date'])
+    df0 = load_prepared(args.filename)
+    summary, returns = backtest(scores, df0['prccq'], args.quantile, args.cost_bps, make_labels(df0))
+    print(summary.to_string(float_format='{0:.4f}'.format))
@@ -0,0 +1,189 @@
+"""Benchmarks of the feature engine steps against the original lambda/map and groupby code paths,
+and of the whole profiled pipeline at several universe sizes (see profiling.py)"""
+
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from feature_engine import (PRICE_CHG_COLS, RANK_COLS, FeatureEngine, adjust_dates, lag, pct_ranks, price_changes,
+                            quarter_dates)
+from ingest import ingest
+from parallel import WORKER_STAGES
+from profiling import Profiler, profile_pipeline
+from synthetic import iter_blocks, write_compustat
+
+
+def timed(func, *args, repeat=3):
+    """Best wall time (seconds) of repeat calls of func(*args) and the result of the last call"""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def random_datadates(n_rows, seed=0):
+    """Frame w/ a datadate column of n_rows random yyyymmdd month end report dates"""
+    rng = np.random.RandomState(seed)
+    months = pd.date_range('1990-01-31', '2020-12-31', freq='ME')
+    dates = months[rng.randint(0, len(months), n_rows)]
+    return pd.DataFrame({'datadate': dates.strftime('%Y%m%d').astype('int64')})
+
+
+def map_quarter_dates(df):
+    """Original path: parse datadate, then replace(day=28) and adjust_dates once per row"""
+    dates = pd.to_datetime(df['datadate'], format='%Y%m%d')
+    dates = dates.map(lambda x: x.replace(day=28))
+    return dates.map(adjust_dates)
+
+
+def bench_quarter_dates(n_rows=1000000):
+    """Compare the vectorized quarter alignment w/ the original lambda/map path"""
+    df = random_datadates(n_rows)
+    t_map, expected = timed(map_quarter_dates, df, repeat=1)
+    t_vec, result = timed(quarter_dates, df)
+    assert (result == pd.DatetimeIndex(expected)).all()
+    print('quarter dates, {0} rows: map {1:.3f}s, vectorized {2:.4f}s ({3:.0f}x)'.format(
+        n_rows, t_map, t_vec, t_map / t_vec))
+
+
+def random_panel(n_tickers, n_quarters, n_cols, gap_frac=0.0, seed=0):
+    """(tic, date) indexed frame of positive random fundamentals, w/ a fraction of the quarters dropped at random"""
+    rng = np.random.RandomState(seed)
+    tics = ['T{0:05d}'.format(i) for i in range(n_tickers)]
+    dates = pd.date_range('1990-01-28', periods=n_quarters, freq='3MS') + pd.Timedelta(days=27)
+    index = pd.MultiIndex.from_product([tics, dates], names=['tic', 'date'])
+    df = pd.DataFrame(rng.lognormal(size=(len(index), n_cols)), index=index,
+                      columns=['col_{0}'.format(i) for i in range(n_cols)])
+    keep = rng.uniform(size=len(df)) >= gap_frac
+    return df.loc[keep]
+
+
+def shift_1yr_chg(df):
+    """Original path: positional shift(4) over the whole frame, then mask the first 4 rows of every ticker"""
+    df4 = np.log(1 + df / df.shift(4))
+    df4.loc[df4.groupby('tic').head(4).index, :] = np.nan
+    return df4
+
+
+def lag_1yr_chg(df):
+    """Per ticker, date aware lag of all columns in one pass"""
+    return np.log(1 + df / lag(df, 4))
+
+
+def bench_1yr_chg(n_tickers=500, n_quarters=120, n_cols=28, gap_frac=0.02):
+    """Compare the 1yr log change via the date aware lag w/ the shift(4) + head(4) masking path"""
+    df = random_panel(n_tickers, n_quarters, n_cols, gap_frac)
+    t_shift, shifted = timed(shift_1yr_chg, df)
+    t_lag, lagged = timed(lag_1yr_chg, df)
+    wrong = (~np.isclose(shifted.to_numpy(), lagged.to_numpy(), equal_nan=True)).any(axis=1).mean()
+    print('1yr log change, {0} rows x {1} cols: shift+mask {2:.3f}s, lag {3:.3f}s ({4:.1f}x), '
+          '{5:.1%} of rows wrong in the shift path w/ {6:.0%} missing quarters'.format(
+              len(df), n_cols, t_shift, t_lag, t_shift / t_lag, wrong, gap_frac))
+
+
+def groupby_price_ranks(df):
+    """Original path: one groupby pct_change per horizon and one groupby rank per rank column"""
+    out = pd.DataFrame(index=df.index)
+    for name, periods in PRICE_CHG_COLS.items():
+        out[name] = df.groupby('tic')['prccq'].pct_change(periods=periods, fill_method=None)
+    both = pd.concat([df, out], axis='columns')
+    for name, col in RANK_COLS.items():
+        out[name] = both.groupby('date')[col].rank(pct=True)
+    return out
+
+
+def fused_price_ranks(df):
+    """All price change horizons, then all percentile ranks in one pass each"""
+    out = price_changes(df['prccq'], PRICE_CHG_COLS)
+    ranks = pct_ranks(pd.concat([df, out], axis='columns'), RANK_COLS)
+    return pd.concat([out, ranks], axis='columns')
+
+
+def bench_price_ranks(n_tickers=500, n_quarters=120):
+    """Compare the fused price change / percentile rank kernel w/ the groupby pct_change / rank path"""
+    df = random_panel(n_tickers, n_quarters, 3)
+    df.columns = ['prccq', 'bk_to_mkt', 'earnings_yld']
+    # rounded values so the ranks have ties, and some missing values
+    df = df.round(1).mask(np.random.RandomState(1).uniform(size=df.shape) < 0.05)
+    t_groupby, expected = timed(groupby_price_ranks, df)
+    t_fused, result = timed(fused_price_ranks, df)
+    assert np.allclose(result.to_numpy(), expected.to_numpy(), equal_nan=True, rtol=0, atol=1e-12)
+    print('price changes + ranks, {0} rows: groupby {1:.3f}s, fused {2:.3f}s ({3:.1f}x)'.format(
+        len(df), t_groupby, t_fused, t_groupby / t_fused))
+
+
+# drops of data_preprocesing.py
+BENCH_DROP_COLS = ['prchq', 'prclq', 'costat', 'prcraq', 'uaptq']
+
+
+def bench_pipeline(sizes=(50, 500, 5000), n_years=10, out=None):
+    """Profile the feature pipeline (read_csv to labels) on synthetic exports of each universe size
+
+    Prints seconds per stage and size, and each stage's time growth relative to the row growth from
+    the smallest to the largest size (~1 is linear scaling, >1 a scaling regression). out: json report"""
+    reports = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_tickers in sizes:
+            filename = os.path.join(tmp, 'compustat_{0}.csv'.format(n_tickers))
+            write_compustat(filename, n_tickers, n_years=n_years)
+            report = profile_pipeline(filename, BENCH_DROP_COLS).report()
+            report['n_tickers'] = n_tickers
+            report['n_rows'] = report['rows'].iloc[0]
+            reports.append(report)
+    reports = pd.concat(reports, ignore_index=True)
+
+    seconds = reports.pivot_table(index='stage', columns='n_tickers', values='seconds', sort=False)
+    n_rows = reports.groupby('n_tickers')['n_rows'].first()
+    seconds['scaling'] = (seconds[sizes[-1]] / seconds[sizes[0]]) / (n_rows[sizes[-1]] / float(n_rows[sizes[0]]))
+    print('pipeline seconds per stage, {0} years of synthetic data:'.format(n_years))
+    print(seconds.to_string(float_format='{0:.4f}'.format))
+    total = reports.groupby('n_tickers').agg(seconds=('seconds', 'sum'), peak_rss_mb=('peak_rss_mb', 'max'))
+    total['rows_per_sec'] = n_rows / total['seconds']
+    print(total.to_string(float_format='{0:.1f}'.format))
+    if out:
+        reports.to_json(out, orient='records', indent=1)
+    return reports
+
+
+def bench_ingest(n_tickers=2000, n_years=30, partition_by='date'):
+    """Time writing a synthetic export and streaming it into partitions (see ingest.py)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'compustat.csv')
+        t_write, n_rows = timed(write_compustat, filename, n_tickers, 1990, n_years, repeat=1)
+        size_mb = os.path.getsize(filename) / 2.0 ** 20
+        t_ingest, names = timed(ingest, filename, os.path.join(tmp, 'parts'), partition_by, BENCH_DROP_COLS, repeat=1)
+    print('ingest, {0} rows ({1:.0f} MB): generate {2:.1f}s, ingest into {3} {4} partitions {5:.1f}s ({6:.0f} rows/sec)'.format(
+        n_rows, size_mb, t_write, len(names), partition_by, t_ingest, n_rows / t_ingest))
+
+
+def bench_parallel(n_tickers=5000, n_years=30, workers=(2, 4, 8)):
+    """Compare the build of the design matrix sharded across processes w/ the serial build
+
+    The parent's share is the build's wall time outside the worker stages (prepare, the normalizer
+    fit, ...): it bounds the speedup at any number of cores"""
+    df = pd.concat(iter_blocks(n_tickers, n_years=n_years), ignore_index=True)
+    t_serial, (_, expected) = timed(FeatureEngine(BENCH_DROP_COLS).build, df, repeat=1)
+    print('parallel build, {0} rows: serial {1:.2f}s'.format(len(df), t_serial))
+    for n in workers:
+        profiler = Profiler()
+        t_parallel, (_, result) = timed(FeatureEngine(BENCH_DROP_COLS, profiler=profiler, workers=n).build, df, repeat=1)
+        assert np.array_equal(result.features, expected.features) and np.array_equal(result.mask, expected.mask)
+        stages = profiler.report()
+        t_workers = stages.loc[stages['stage'].isin(WORKER_STAGES), 'seconds'].sum()
+        print('  {0} workers {1:.2f}s ({2:.1f}x), parent alone {3:.2f}s ({4:.0%} of serial, at most {5:.1f}x)'.format(
+            n, t_parallel, t_serial / t_parallel, t_parallel - t_workers, (t_parallel - t_workers) / t_serial,
+            t_serial / (t_parallel - t_workers)))
+
+
+if __name__ == '__main__':
+    bench_quarter_dates()
+    bench_1yr_chg()
+    bench_price_ranks()
+    bench_pipeline()
+    bench_ingest()
+    bench_parallel()
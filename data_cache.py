@@ -0,0 +1,87 @@
+"""On-disk columnar cache of the prepared (typed, (tic, date) indexed, numeric only) compustat frame
+
+The first load of an export parses the csv and stores every column as a .npy array, later loads
+memory-map those arrays instead of parsing the csv again. The cache key is a hash of the source
+file contents and of the column selection, so a new export or a different selection gets its own entry."""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from feature_engine import prepare
+
+# bump when the stored layout changes so old entries are not picked up
+CACHE_VERSION = 1
+
+# default location of the cache, next to the scripts
+CACHE_DIR = '.data_cache'
+
+
+def file_hash(filename, block_size=1 << 20):
+    """sha1 of the file contents, read in blocks so multi-GB exports are never fully in memory"""
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def cache_key(filename, drop_cols=(), date_source='datadate'):
+    """Cache key of a source file and the column selection applied to it"""
+    selection = json.dumps({'version': CACHE_VERSION,
+                            'drop_cols': sorted(drop_cols),
+                            'date_source': date_source})
+    return hashlib.sha1((file_hash(filename) + selection).encode()).hexdigest()
+
+
+def save_frame(df1, path):
+    """Write a prepared frame as one .npy array per column + the index arrays"""
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    tic_codes, tics = pd.factorize(df1.index.get_level_values('tic'))
+    np.save(os.path.join(tmp_path, 'tic_codes.npy'), tic_codes.astype('int32'))
+    np.save(os.path.join(tmp_path, 'tics.npy'), np.asarray(tics, dtype=str))
+    dates = df1.index.get_level_values('date').values.astype('datetime64[ns]')
+    np.save(os.path.join(tmp_path, 'date.npy'), dates)
+
+    columns = list(df1.columns)
+    for i, col in enumerate(columns):
+        np.save(os.path.join(tmp_path, 'col_{0}.npy'.format(i)), df1[col].to_numpy())
+    with open(os.path.join(tmp_path, 'columns.json'), 'w') as f:
+        json.dump(columns, f)
+
+    # move into place in one step so a crashed write never leaves a half written entry
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp_path, path)
+
+
+def load_frame(path, mmap=True):
+    """Read a frame written by save_frame, memory-mapping the column arrays"""
+    mmap_mode = 'r' if mmap else None
+    with open(os.path.join(path, 'columns.json')) as f:
+        columns = json.load(f)
+
+    tics = np.load(os.path.join(path, 'tics.npy'))
+    tic_codes = np.load(os.path.join(path, 'tic_codes.npy'), mmap_mode=mmap_mode)
+    dates = np.load(os.path.join(path, 'date.npy'), mmap_mode=mmap_mode)
+    index = pd.MultiIndex.from_arrays([pd.Categorical.from_codes(tic_codes, tics).astype(str),
+                                       pd.DatetimeIndex(dates)], names=['tic', 'date'])
+
+    data = {col: np.load(os.path.join(path, 'col_{0}.npy'.format(i)), mmap_mode=mmap_mode)
+            for i, col in enumerate(columns)}
+    return pd.DataFrame(data, index=index, columns=columns, copy=False)
+
+
+def load_prepared(filename, drop_cols=(), date_source='datadate', cache_dir=CACHE_DIR, mmap=True):
+    """Prepared frame of a compustat export: from the cache if this file + selection was parsed before, else parse and cache it"""
+    path = os.path.join(cache_dir, cache_key(filename, drop_cols, date_source))
+    if not os.path.isdir(path):
+        df1 = prepare(pd.read_csv(filename), drop_cols, date_source)
+        save_frame(df1, path)
+    return load_frame(path, mmap)
@@ -0,0 +1,64 @@
+"""Compact design matrix: float32 feature block + bit-packed missingness (nil?) indicators"""
+
+import numpy as np
+import pandas as pd
+
+
+def nbytes(obj):
+    """Memory used by a frame, series, array or design matrix in bytes"""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+    return int(obj.nbytes)
+
+
+def memory_report(sizes):
+    """Readable table of a {name: bytes} dict"""
+    lines = ['{0:<20}{1:>12.1f} MB'.format(name, size / 2.0 ** 20) for name, size in sizes.items()]
+    lines.append('{0:<20}{1:>12.1f} MB'.format('total', sum(sizes.values()) / 2.0 ** 20))
+    return '\n'.join(lines)
+
+
+class DesignMatrix(object):
+    """Model inputs stored as a float32 feature block + a bit-packed mask of the values that were missing
+
+    The dense model input is [features | nil?:features] (the mask as 0/1 columns, like the original
+    df_isnil), it is only materialized by to_dense(), as float32 and optionally for a slice of rows."""
+
+    def __init__(self, features, mask, index, columns):
+        self.features = features
+        self.mask = mask
+        self.index = index
+        self.columns = list(columns)
+
+    @property
+    def shape(self):
+        """Shape of the dense model input"""
+        return len(self.index), 2 * len(self.columns)
+
+    @property
+    def nbytes(self):
+        """Memory used by the feature block and the packed mask"""
+        return int(self.features.nbytes + self.mask.nbytes)
+
+    @property
+    def dense_columns(self):
+        """Column names of the dense model input"""
+        return self.columns + ['nil?:' + name for name in self.columns]
+
+    def to_dense(self, rows=slice(None)):
+        """float32 model input of the selected rows: features followed by the 0/1 missingness indicators"""
+        features = self.features[rows]
+        out = np.empty((len(features), 2 * len(self.columns)), dtype=np.float32)
+        out[:, :len(self.columns)] = features
+        out[:, len(self.columns):] = np.unpackbits(self.mask[rows], axis=1, count=len(self.columns))
+        return out
+
+    def to_frame(self):
+        """Dense model input as a (tic, date) indexed frame (the original df_final layout)"""
+        return pd.DataFrame(self.to_dense(), index=self.index, columns=self.dense_columns)
+
+    def take(self, rows):
+        """Design matrix of a subset of the rows (bool mask or positions)"""
+        return DesignMatrix(self.features[rows], self.mask[rows], self.index[rows], self.columns)
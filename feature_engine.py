@@ -0,0 +1,598 @@
+"""Feature engine for company fundamental data: builds the MLP/RNN model inputs from a Compustat export, either over the full history or incrementally one quarter at a time"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from design import DesignMatrix, memory_report, nbytes
+from normalization import Normalizer
+from profiling import Profiler
+from registry import FEATURES, KERNELS, FeatureFrame, register, resolve, role
+
+# percent price change columns and the periods (in quarters) they look back
+PRICE_CHG_COLS = {'%_prc_chg_1qtr': 1, '%_prc_chg_2qtr': 2, '%_prc_chg_3qtr': 3, '%_prc_chg_1yr': 4}
+
+# cross-sectional (per date) percentile rank columns and the column each one ranks
+RANK_COLS = {'mom_rank_1qtr_%': '%_prc_chg_1qtr',
+             'mom_rank_2qtr_%': '%_prc_chg_2qtr',
+             'mom_rank_3qtr_%': '%_prc_chg_3qtr',
+             'bk_to_mkt_rank_pct': 'bk_to_mkt',
+             'earnings_yld_rank_pct': 'earnings_yld'}
+
+# valuation features derived row by row from the fundamentals
+VALUATION_COLS = ['shareholders_equity', 'mkt_cap', 'bk_to_mkt', 'entrprs_val', 'earnings_yld']
+
+# rows imputed at a time (see impute)
+IMPUTE_BLOCK_ROWS = 65536
+
+# number of trailing quarters per ticker the incremental mode has to keep:
+# the 1yr log change at t needs the filled value at t-4, which is forward filled from t-5,
+# and the final forward fill at t needs the features at t-1 (which in turn reach back to t-6)
+LOOKBACK = 6
+
+
+# define a helper function: adjust_dates
+def adjust_dates(x) :
+    """Function to allign dates to match for each quarter end"""
+    if(x.month == 1 or x.month == 2 or x.month == 3) :
+        x = x.replace(month=1)
+    elif(x.month == 4 or x.month == 5 or x.month == 6):
+        x = x.replace(month=4)
+    elif(x.month == 7 or x.month == 8 or x.month == 9):
+        x = x.replace(month=7)
+    elif(x.month == 10 or x.month == 11 or x.month == 12):
+        x = x.replace(month=10)
+    return x
+
+
+def quarter_dates(df, source='datadate'):
+    """Vectorized quarter alignment: the 28th of the first month of each row's quarter (same as adjust_dates)
+
+    source='datadate' buckets the report date exactly like adjust_dates, source='datacqtr' / 'datafqtr'
+    uses compustat's calendar / fiscal quarter label instead (e.g. a quarter ending 31 jan is 1999Q4
+    in datacqtr but 2000-01-28 from datadate)"""
+    if source == 'datadate':
+        dates = df['datadate']
+        if pd.api.types.is_numeric_dtype(dates):
+            # yyyymmdd integers: get year and month w/o parsing a date per row
+            ymd = dates.to_numpy(dtype='int64')
+            years, months = ymd // 10000, ymd // 100 % 100
+        else:
+            dates = pd.to_datetime(dates.astype(str), format='%Y%m%d')
+            years, months = dates.dt.year.to_numpy(), dates.dt.month.to_numpy()
+        quarters = (months - 1) // 3
+    elif source in ('datacqtr', 'datafqtr'):
+        labels = df[source].astype(str)
+        years = labels.str[:4].astype('int64').to_numpy()
+        quarters = labels.str[5].astype('int64').to_numpy() - 1
+    else:
+        raise ValueError('unknown quarter source: {0}'.format(source))
+
+    # months since 1970-01 of the first month of the quarter, then move to day 28
+    first_month = ((years - 1970) * 12 + quarters * 3).astype('datetime64[M]')
+    day_28 = first_month.astype('datetime64[D]') + np.timedelta64(27, 'D')
+    return pd.DatetimeIndex(day_28.astype('datetime64[ns]'))
+
+
+def quarter_number(index):
+    """Integer quarter number (year*4 + quarter - 1) of every row of a (tic, date) index"""
+    dates = index.get_level_values('date')
+    return np.asarray(dates.year * 4 + (dates.month - 1) // 3, dtype='int64')
+
+
+def lag(df, periods):
+    """Per ticker, date aware lag: the row of the same ticker `periods` quarters earlier, NaN if that quarter is missing
+
+    All columns are looked up in one vectorized pass over the (tic, quarter) keys, so values never
+    leak across tickers and gaps in a ticker's quarters give NaN instead of a wrong row"""
+    values = df.to_numpy()
+    if values.dtype.kind != 'f':
+        values = values.astype(float)
+    if len(df) == 0:
+        return df.copy()
+
+    # one int64 key per row: ticker code in the high digits, quarter number in the low ones
+    tic_codes = df.index.codes[df.index.names.index('tic')].astype('int64')
+    keys = tic_codes * 100000 + quarter_number(df.index)
+    if (keys[1:] >= keys[:-1]).all():
+        order = np.arange(len(keys))
+    else:
+        order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    # position of the lagged key, rows whose lagged quarter does not exist get NaN
+    wanted = keys - periods
+    pos = np.minimum(np.searchsorted(sorted_keys, wanted), len(keys) - 1)
+    found = sorted_keys[pos] == wanted
+    lagged = values[order[pos]]
+    lagged[~found] = np.nan
+    return pd.DataFrame(lagged, index=df.index, columns=df.columns)
+
+
+def dense_layout(index):
+    """Ticker code and quarter offset of every row of a (tic, date) index + the shape of the dense ticker x quarter grid"""
+    tic_codes, tics = pd.factorize(index.get_level_values('tic'))
+    quarters = quarter_number(index)
+    q_codes = quarters - quarters.min()
+    return tic_codes, q_codes, (len(tics), int(q_codes.max()) + 1)
+
+
+def price_changes(prices, horizons):
+    """Percent price change over every horizon (name: quarters) in one pass over the dense ticker x quarter grid
+
+    Shifting along the quarter axis is date aware, like lag(): a missing quarter gives NaN"""
+    if len(prices) == 0:
+        return pd.DataFrame(index=prices.index, columns=list(horizons), dtype=float)
+    tic_codes, q_codes, shape = dense_layout(prices.index)
+    values = prices.to_numpy()
+    grid = np.full(shape, np.nan, dtype=values.dtype if values.dtype.kind == 'f' else float)
+    grid[tic_codes, q_codes] = values
+
+    changes = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, periods in horizons.items():
+            chg = np.full_like(grid, np.nan)
+            chg[:, periods:] = grid[:, periods:] / grid[:, :-periods] - 1
+            changes[name] = chg[tic_codes, q_codes]
+    return pd.DataFrame(changes, index=prices.index)
+
+
+def pct_rank_rows(m):
+    """Percentile rank along the rows of a 2d array, same as pandas rank(pct=True): ties get their average rank, NaN is skipped"""
+    n_rows, n_cols = m.shape
+    if m.size == 0:
+        return m.astype(float)
+    order = np.argsort(m, axis=1, kind='stable')
+    sorted_m = np.take_along_axis(m, order, axis=1)
+
+    # runs of equal sorted values are the ties, a new run starts at every row start and at every change
+    starts_run = np.ones(m.shape, dtype=bool)
+    starts_run[:, 1:] = sorted_m[:, 1:] != sorted_m[:, :-1]
+    starts_run = starts_run.ravel()
+    run = np.cumsum(starts_run) - 1
+    first = np.flatnonzero(starts_run)
+    last = np.append(first[1:], starts_run.size) - 1
+
+    # average 1-based rank of every run, scattered back to the unsorted positions
+    run_rank = (first % n_cols + last % n_cols) / 2 + 1
+    ranks = np.empty(m.shape)
+    np.put_along_axis(ranks, order, run_rank[run].reshape(m.shape), axis=1)
+
+    valid = ~np.isnan(m)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = ranks / valid.sum(axis=1, keepdims=True)
+    pct[~valid] = np.nan
+    return pct
+
+
+def pct_ranks(df, rank_cols):
+    """Per date percentile rank of every column in rank_cols (rank name: column) in one sort over the dense quarter x ticker grid"""
+    if len(df) == 0:
+        return pd.DataFrame(index=df.index, columns=list(rank_cols), dtype=float)
+    tic_codes, q_codes, (n_tics, n_quarters) = dense_layout(df.index)
+    grid = np.full((len(rank_cols), n_quarters, n_tics), np.nan)
+    for k, col in enumerate(rank_cols.values()):
+        grid[k, q_codes, tic_codes] = df[col].to_numpy()
+
+    # every (column, quarter) pair is one row to rank across tickers
+    pct = pct_rank_rows(grid.reshape(-1, n_tics)).reshape(grid.shape)
+    return pd.DataFrame({name: pct[k, q_codes, tic_codes] for k, name in enumerate(rank_cols)}, index=df.index)
+
+
+def is_prepared(df):
+    """True if df is already indexed by (tic, date), e.g. loaded from the data cache"""
+    return list(df.index.names) == ['tic', 'date'] and 'datadate' not in df.columns
+
+
+def prepare(df, drop_cols=(), date_source='datadate'):
+    """Index raw compustat rows by (tic, date) and keep only the fundamental data columns
+
+    Frames that are already prepared (see data_cache.py) only get drop_cols removed"""
+    if is_prepared(df):
+        return df.drop(list(drop_cols), axis=1, errors='ignore')
+    df = df.copy()
+
+    # adjust dates to match per quarter for ease of processing:
+    # jan-mar = 1, apr-jun = 4, jul-sep = 7, oct-dec = 10, day = 28
+    df['date'] = quarter_dates(df, date_source)
+    df.drop(['datadate'], axis=1, inplace=True)
+
+    # reindex to a hierarchical index with date and ticker symbol (tic)
+    df.set_index(['tic', 'date'], inplace=True)
+    df.sort_index(inplace=True)
+
+    # drop columns with unnecessary data, including non-numeric status flags (costat)
+    df = df.loc[:, 'actq':]
+    df = df.drop(list(drop_cols), axis=1)
+    return df.select_dtypes('number')
+
+
+# registered derived features (see registry.py)
+
+def price_change_kernel(df, features):
+    """All price change horizons of a batch in one pass (see price_changes)"""
+    return price_changes(df[features[0].inputs[0]], {feature.name: feature.args for feature in features})
+
+
+def pct_rank_kernel(df, features):
+    """All percentile ranks of a batch in one pass (see pct_ranks)"""
+    return pct_ranks(df, {feature.name: feature.inputs[0] for feature in features})
+
+
+KERNELS['price_changes'] = price_change_kernel
+KERNELS['pct_ranks'] = pct_rank_kernel
+
+# calculate percent price change: 1qtr, 2qtr, 3qtr, 1yr
+for name, periods in PRICE_CHG_COLS.items():
+    register(name, ['prccq'], 'ticker', 'input', kernel='price_changes', args=periods)
+
+
+# calculate: shareholders equity = total asets (atq) - total liabilities (ltq)
+@register('shareholders_equity', ['atq', 'ltq'])
+def shareholders_equity(df):
+    return df['atq'] - df['ltq']
+
+
+# calc: market capitalization = #shares outstanding * price per share
+@register('mkt_cap', ['cshoq', 'prccq'])
+def mkt_cap(df):
+    return df['cshoq'] * df['prccq']
+
+
+# calculate book-to-market = shareholders equity / market capitalization
+@register('bk_to_mkt', ['shareholders_equity', 'mkt_cap'])
+def bk_to_mkt(df):
+    return df['shareholders_equity'] / df['mkt_cap']
+
+
+# calculate enterprise value = [Market cap(mkt_cap)
+#                               +(debt in current liabilities(dlcq)
+#                               +long term debt (dlttq))
+#                               + market value preferred equity (pstkq*prccq)
+#                               + noncontrolling interest (mibtq)]
+#                               - [cash and cash eqiv (chechy)]
+@register('entrprs_val', ['mkt_cap', 'dlcq', 'dlttq', 'pstkq', 'prccq', 'mibtq', 'chechy'])
+def entrprs_val(df):
+    return (df['mkt_cap'] + df['dlcq'] + df['dlttq'] + (df['pstkq']*df['prccq']) + df['mibtq']) - (df['chechy'])
+
+
+# calculate earnings yield = operating income(oiadpq) / enterprise value(entrprs_val)
+# (may be negative: normalized, but no log change)
+@register('earnings_yld', ['oiadpq', 'entrprs_val'], role='ratio')
+def earnings_yld(df):
+    return df['oiadpq'] / df['entrprs_val']
+
+
+# calculate relative percentile ranking per date of momentum (price change), book-to-market
+# and earnings yield
+for name, col in RANK_COLS.items():
+    register(name, [col], 'date', 'rank', kernel='pct_ranks')
+
+# derived features of the base frame (df1), in column order
+BASE_FEATURES = (list(PRICE_CHG_COLS) + ['mom_rank_1qtr_%', 'mom_rank_2qtr_%', 'mom_rank_3qtr_%'] + VALUATION_COLS
+                 + ['bk_to_mkt_rank_pct', 'earnings_yld_rank_pct'])
+
+
+def ticker_features(df1, features=BASE_FEATURES):
+    """Add the row / per ticker features needed for `features` (price changes, valuation features, ...) to the prepared frame
+
+    None of them needs other tickers, so any set of whole tickers can be computed on its own
+    (see parallel.py)"""
+    df1 = df1.copy()
+
+    # NOTE first fill mibtq (non controlling interest) NaN values w/ zero for calculation
+    df1['mibtq'] = df1['mibtq'].fillna(0)
+
+    names = [name for level in resolve(features, set(df1.columns)) for name in level if FEATURES[name].kind != 'date']
+    return pd.concat([df1, FeatureFrame(df1).compute(names)], axis='columns')
+
+
+def date_features(df1, features=BASE_FEATURES, rank_rows=None):
+    """The per date features among `features` (percentile ranks, ...), over all tickers of every date
+
+    rank_rows optionally restricts them to a boolean mask of rows, the other rows are NaN"""
+    names = [name for name in features if name in FEATURES and FEATURES[name].kind == 'date']
+    return FeatureFrame(df1, rank_rows).compute(names)
+
+
+def base_columns(raw_cols, features=BASE_FEATURES):
+    """Column order of the base frame (df1) built from the prepared columns raw_cols"""
+    return list(raw_cols) + list(features)
+
+
+def add_base_features(df1, rank_rows=None, features=BASE_FEATURES):
+    """Add the derived features (by default price changes, valuation features and their percentile ranks) to the prepared frame
+
+    rank_rows optionally restricts the per date ranks to a boolean mask of rows, the rank
+    columns of the other rows are left NaN for the caller to fill in"""
+    raw_cols = list(df1.columns)
+    df1 = ticker_features(df1, features)
+
+    # all per date ranks in one pass
+    df1 = pd.concat([df1, date_features(df1, features, rank_rows)], axis='columns')
+    return df1[base_columns(raw_cols, features)]
+
+
+def fill_base(df1):
+    """Fill NaN values : fill forward w/ limit=1 per ticker, then fill w/ 0 (one imputation pass per dtype block)"""
+    tic_codes = df1.index.codes[df1.index.names.index('tic')]
+    blocks = []
+    for dtype in df1.dtypes.unique():
+        cols = df1.columns[(df1.dtypes == dtype).to_numpy()]
+        values = df1[cols].to_numpy(copy=True)
+        impute(values, tic_codes)
+        blocks.append(pd.DataFrame(values, index=df1.index, columns=cols))
+    if len(blocks) == 1:
+        return blocks[0]
+    return pd.concat(blocks, axis='columns')[df1.columns]
+
+
+def fundamentals(df2):
+    """Fundamental items of the filled frame: raw items + derived fundamentals and ratios (no price changes and ranks)"""
+    return df2[[col for col in df2.columns if role(col) in ('fundamental', 'ratio')]]
+
+
+def impute(values, tic_codes, infs=False, mask=False, block_rows=IMPUTE_BLOCK_ROWS):
+    """In place imputation of a (tic, date) sorted array: [inf -> NaN,] fill forward w/ limit=1 per ticker, then w/ 0
+
+    Runs block_rows rows at a time, so the temporary masks stay small and in cache; the last
+    row of the previous block (before it was filled) carries over, so a NaN at the start of a
+    block is filled exactly like any other. Returns the bit-packed mask of the values that
+    were NaN (see design.py) if mask=True"""
+    packed = np.empty((len(values), -(-values.shape[1] // 8)), dtype=np.uint8) if mask else None
+    prev, prev_code = None, None
+    for start in range(0, len(values), block_rows):
+        block, codes = values[start:start + block_rows], tic_codes[start:start + block_rows]
+        missing = np.isnan(block)
+        if mask:
+            packed[start:start + len(block)] = np.packbits(missing, axis=1)
+        if infs:
+            block[np.isinf(block)] = np.nan
+            missing = np.isnan(block)
+        last = block[-1].copy()
+
+        # a NaN takes the previous row's value if it is the same ticker (the row before the block for row 0)
+        fill = missing[1:] & (codes[1:] == codes[:-1])[:, None]
+        block[1:][fill] = block[:-1][fill]
+        if prev is not None and codes[0] == prev_code:
+            block[0][missing[0]] = prev[missing[0]]
+        prev, prev_code = last, codes[-1]
+
+        block[np.isnan(block)] = 0
+    return packed
+
+
+def one_year_changes(df3):
+    """log(1 + 1yr % change) of the fundamental items (not the ratios, e.g. earnings_yld), lagged per ticker by date"""
+    df_temp = df3[[col for col in df3.columns if role(col) == 'fundamental']]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.log(1 + df_temp / lag(df_temp, 4))
+
+
+def fill_features(features, tic_codes):
+    """In place: inf -> NaN, fill forward w/ limit=1 per ticker, then w/ 0 : bit-packed mask of the values that were NaN"""
+    return impute(features, tic_codes, infs=True, mask=True)
+
+
+def assemble_design(df1, df2, normalizer, profiler=None):
+    """Build the model inputs from the base frame (df1), its filled copy (df2) and the fitted normalizer of the fundamentals
+
+    The feature blocks are written straight into one float32 array, the missingness indicators are
+    kept bit-packed (see design.py), so neither the nil? block nor a float64 copy of X is ever built"""
+    stage = (profiler or Profiler()).stage
+    n_rows = len(df1)
+
+    # NORMALIZE fundamental items : df3
+    with stage('normalize', n_rows):
+        df3 = fundamentals(df2)
+        df3_normalized = normalizer.transform(df3)
+
+    # calculate log(% change 1 yr) for each fundamental item that is not negative value,
+    # lagged per ticker by date so data does not leak between groups (different companies)
+    with stage('1yr change', n_rows):
+        df4 = one_year_changes(df3)
+
+    # df 6 = yr_chg_fundamentals_df (df4) + rel_momentum/val_df (df5) + normalized_fundamentals_df (df3_normalized)
+    with stage('concatenate', n_rows):
+        df5 = df1.loc[:, [col for col in df1.columns if role(col) == 'rank']]
+        blocks = [df4, df5, df3_normalized]
+        columns = ([name + '_1yr_chg' for name in df4.columns] + list(df5.columns)
+                   + ['norm:' + name for name in df3_normalized.columns])
+        features = np.empty((n_rows, len(columns)), dtype=np.float32)
+        start = 0
+        for block in blocks:
+            features[:, start:start + block.shape[1]] = block.to_numpy()
+            start += block.shape[1]
+
+    # null matrix, then fill NaN (and inf) values: fill forward w/ limit=1 per ticker, then w/ 0
+    with stage('fill features', n_rows):
+        mask = fill_features(features, df1.index.codes[df1.index.names.index('tic')])
+    return DesignMatrix(features, mask, df1.index, columns)
+
+
+def forward_returns(prices, horizon):
+    """Return from each quarter to `horizon` quarters later, per ticker and date aware (NaN if either quarter is missing)"""
+    tic_codes, q_codes, shape = dense_layout(prices.index)
+    grid = np.full(shape, np.nan)
+    grid[tic_codes, q_codes] = prices.to_numpy(dtype=float)
+    fwd = np.full(shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fwd[:, :-horizon] = grid[:, horizon:] / grid[:, :-horizon] - 1
+    return fwd, tic_codes, q_codes
+
+
+def make_labels(df1, horizon=4, quantile=0.5):
+    """Target variables: does the stock's forward `horizon` quarter return beat the cross-sectional quantile of its date
+
+    quantile = q        : 1 if the forward return is above the q quantile of all stocks that date, else 0
+                          (q=0.5, horizon=4 is outperformance of the median stock over one year)
+    quantile = (lo, hi) : 1 above the hi quantile, 0 below the lo quantile, NaN in between
+    Rows whose forward return is unknown (end of history, missing quarters, delisted) are NaN."""
+    if len(df1) == 0:
+        return pd.Series(index=df1.index, dtype=float)
+    fwd, tic_codes, q_codes = forward_returns(df1['prccq'], horizon)
+    fwd[~np.isfinite(fwd)] = np.nan
+
+    # cross-sectional thresholds: one quantile per quarter over all tickers
+    lo, hi = (quantile, quantile) if np.isscalar(quantile) else quantile
+    valid_qtrs = ~np.isnan(fwd).all(axis=0)
+    thresholds = np.full((2, fwd.shape[1]), np.nan)
+    thresholds[:, valid_qtrs] = np.nanquantile(fwd[:, valid_qtrs], [lo, hi], axis=0)
+
+    labels = np.where(fwd > thresholds[1], 1.0, np.nan)
+    labels[fwd <= thresholds[0]] = 0.0
+    return pd.Series(labels[tic_codes, q_codes], index=df1.index, name='y')
+
+
+class FeatureEngine(object):
+    """Builds the feature frame over a full history and then keeps it up to date one quarter at a time
+
+    Only the last LOOKBACK quarters of every ticker and the normalizer statistics are kept
+    between calls, so update() costs time proportional to the new quarter and not to the full
+    history. The default normalizer (expanding per date statistics, see normalization.py) never
+    scales a row w/ data from a later quarter."""
+
+    def __init__(self, drop_cols=(), date_source='datadate', normalizer=None, profiler=None, workers=None,
+                 features=None):
+        self.drop_cols = list(drop_cols)
+        self.date_source = date_source
+        # registered derived features of the base frame (see registry.py), BASE_FEATURES by default
+        self.features = list(BASE_FEATURES if features is None else features)
+        self.normalizer = normalizer if normalizer is not None else Normalizer()
+        # wall time / peak RSS / rows per sec of every stage of build() and update() (see profiling.py)
+        self.profiler = profiler if profiler is not None else Profiler()
+        # processes of build(): > 1 shards the per ticker stages across a process pool (see parallel.py)
+        self.workers = workers
+        self.tail = None
+        self.memory = {}
+
+    def build(self, df):
+        """Build the base frame and the design matrix over the full history of raw rows : (df1, design)"""
+        stage = self.profiler.stage
+        with stage('prepare', len(df)):
+            df0 = prepare(df, self.drop_cols, self.date_source)
+        if self.workers and self.workers > 1 and len(df0):
+            from parallel import build_sharded
+            df1, df2, design = build_sharded(df0, self.normalizer, self.workers, self.profiler, features=self.features)
+        else:
+            with stage('base features', len(df0)):
+                df1 = add_base_features(df0, features=self.features)
+            df2, design = self.fit_design(df1)
+        self.tail = df1.groupby('tic').tail(LOOKBACK)
+
+        # memory used by each stage of the pipeline (see memory_report), from the prepared numeric
+        # frame on (a deep count of the raw string columns takes longer than the feature stages)
+        self.memory = {'prepared (df0)': nbytes(df0), 'base (df1)': nbytes(df1), 'filled (df2)': nbytes(df2),
+                       'features': nbytes(design.features), 'nil? mask': nbytes(design.mask)}
+        return df1, design
+
+    def fit_design(self, df1):
+        """Fill the base frame, fit the normalizer on it and assemble the design matrix : (df2, design)"""
+        stage = self.profiler.stage
+        with stage('fill base', len(df1)):
+            df2 = fill_base(df1)
+        with stage('fit normalizer', len(df2)):
+            self.normalizer.fit(fundamentals(df2))
+        return df2, assemble_design(df1, df2, self.normalizer, self.profiler)
+
+    def add_features(self, df1, names):
+        """Add registered features to the base frame of the last build, computing only them (and their inputs
+        that are not in df1), and rebuild the design matrix : (df1, design)
+
+        The price changes, ranks, ... already in df1 are not computed again, and later update()
+        calls include the new features"""
+        new = [name for name in names if name not in self.features]
+        with self.profiler.stage('add features', len(df1)):
+            df1 = pd.concat([df1, FeatureFrame(df1).compute(new)], axis='columns')
+        self.features += new
+        df2, design = self.fit_design(df1)
+        self.tail = df1.groupby('tic').tail(LOOKBACK)
+        return df1, design
+
+    def build_features(self, df):
+        """Build the feature frame over the full history of raw rows"""
+        return self.build(df)[1].to_frame()
+
+    def build_design(self, df, horizon=4, quantile=0.5, dropna=True):
+        """Build the compact design matrix and the float32 targets over the full history of raw rows : (X, y)
+
+        Only the rows w/ a known target are returned (see make_labels), unless dropna=False
+        (e.g. for sequences, which need every quarter of a ticker and have NaN targets)"""
+        df1, design = self.build(df)
+        y = make_labels(df1, horizon, quantile).to_numpy().astype(np.float32)
+        if not dropna:
+            return design, y
+        labelled = ~np.isnan(y)
+        return design.take(labelled), y[labelled]
+
+    def memory_report(self):
+        """Memory used by each stage of the last build"""
+        return memory_report(self.memory)
+
+    def update(self, new_quarter_rows):
+        """Build the feature rows for newly landed raw rows, using only the trailing per ticker state"""
+        return self.update_design(new_quarter_rows).to_frame()
+
+    def update_design(self, new_quarter_rows):
+        """Build the design matrix of newly landed raw rows, using only the trailing per ticker state
+
+        A quarter may land in several batches: the ranks of a later batch are over all tickers of
+        the date so far (earlier batches included), the rows already returned are not revised"""
+        if self.tail is None:
+            raise ValueError('build_features must be called before update')
+        new = prepare(new_quarter_rows, self.drop_cols, self.date_source)
+        if new.index.isin(self.tail.index).any():
+            raise ValueError('update rows overlap quarters that were already processed')
+
+        # compute the per ticker features of the new rows on the trailing window + new rows
+        # and the ranks over every row of the new dates (incl. earlier batches of the same quarter),
+        # the trailing rows keep the values they were built with
+        combined = pd.concat([self.tail.loc[:, list(new.columns)], new]).sort_index()
+        is_new = combined.index.isin(new.index)
+        dates = combined.index.get_level_values('date')
+        rank_rows = dates.isin(new.index.get_level_values('date').unique())
+        df1 = add_base_features(combined, rank_rows=rank_rows, features=self.features)
+        df1.loc[~is_new, :] = self.tail.loc[df1.index[~is_new], list(df1.columns)]
+
+        df2 = fill_base(df1)
+        self.normalizer.partial_fit(fundamentals(df2).loc[is_new])
+        self.tail = df1.groupby('tic').tail(LOOKBACK)
+
+        return assemble_design(df1, df2, self.normalizer, self.profiler).take(is_new)
+
+    def save(self, path):
+        """Write the engine state (settings, normalizer statistics, trailing quarters per ticker) to a directory"""
+        from data_cache import save_frame
+
+        os.makedirs(path, exist_ok=True)
+        settings = {'drop_cols': self.drop_cols, 'date_source': self.date_source, 'features': self.features,
+                    'lookback': LOOKBACK}
+        with open(os.path.join(path, 'engine.json'), 'w') as f:
+            json.dump(settings, f)
+        self.normalizer.save(os.path.join(path, 'normalizer.json'))
+        if self.tail is not None:
+            save_frame(self.tail, os.path.join(path, 'tail'))
+
+    @classmethod
+    def load(cls, path):
+        """Read an engine written by save(), ready for update()"""
+        from data_cache import load_frame
+
+        with open(os.path.join(path, 'engine.json')) as f:
+            settings = json.load(f)
+        # the saved tail must cover the quarters update() looks back on (1yr changes, forward fills)
+        if settings['lookback'] != LOOKBACK:
+            raise ValueError('engine state was saved w/ LOOKBACK={0}, this version needs LOOKBACK={1}'.format(
+                settings['lookback'], LOOKBACK))
+        engine = cls(settings['drop_cols'], settings['date_source'],
+                     Normalizer.load(os.path.join(path, 'normalizer.json')), features=settings.get('features'))
+        if os.path.isdir(os.path.join(path, 'tail')):
+            engine.tail = load_frame(os.path.join(path, 'tail'), mmap=False)
+        return engine
+
+
+def build_features(df, drop_cols=(), date_source='datadate', normalizer=None):
+    """Build the feature frame over the full history of raw compustat rows"""
+    return FeatureEngine(drop_cols, date_source, normalizer).build_features(df)
@@ -0,0 +1,278 @@
+"""Partitioned on-disk store of design matrices (see design.py) and a streaming batch input pipeline over it
+
+A store is written in one go from an in-memory design matrix (write_feature_store), or quarter by
+quarter from the per date partitions of ingest.py (append_partition / write_partitions), w/o ever
+holding more than the new quarter's design matrix in memory.
+
+Training reads the store partition by partition (memory-mapped), shuffles rows within a buffer and
+builds the dense float32 batches in background threads, so neither the full feature matrix nor its
+dense copy has to fit in memory and the CPU prepares the next batches while the model trains."""
+
+import json
+import os
+import queue
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from design import DesignMatrix
+from feature_engine import make_labels, quarter_number
+from ingest import partition_name, stream_designs
+
+# rows shuffled together (as in a tf.data shuffle buffer)
+SHUFFLE_BUFFER = 100000
+
+# batches prepared ahead of the consumer
+PREFETCH = 8
+
+
+def save_partition(path, X, y):
+    """Write one partition: feature block, packed mask, targets and index arrays"""
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'features.npy'), X.features)
+    np.save(os.path.join(path, 'mask.npy'), X.mask)
+    np.save(os.path.join(path, 'y.npy'), np.asarray(y, dtype=np.float32))
+    np.save(os.path.join(path, 'tic.npy'), np.asarray(X.index.get_level_values('tic'), dtype=str))
+    np.save(os.path.join(path, 'date.npy'), X.index.get_level_values('date').values.astype('datetime64[ns]'))
+
+
+def load_partition(path, columns, mmap=True):
+    """Read one partition written by save_partition : (X, y)"""
+    mmap_mode = 'r' if mmap else None
+    index = pd.MultiIndex.from_arrays([np.load(os.path.join(path, 'tic.npy')),
+                                       pd.DatetimeIndex(np.load(os.path.join(path, 'date.npy')))],
+                                      names=['tic', 'date'])
+    X = DesignMatrix(np.load(os.path.join(path, 'features.npy'), mmap_mode=mmap_mode),
+                     np.load(os.path.join(path, 'mask.npy'), mmap_mode=mmap_mode), index, columns)
+    return X, np.load(os.path.join(path, 'y.npy'), mmap_mode=mmap_mode)
+
+
+def write_feature_store(out_dir, X, y, partition_by='date'):
+    """Split a design matrix and its targets into per date (or per ticker) partitions under out_dir
+
+    Rows w/ an unknown (NaN) target are not stored. A manifest.json lists the partitions, their
+    row counts and the feature columns. Needs the whole X in memory, see append_partition to
+    write the store quarter by quarter"""
+    y = np.asarray(y, dtype=np.float32)
+    labelled = ~np.isnan(y)
+    X, y = X.take(labelled), y[labelled]
+    keys = X.index.get_level_values(partition_by)
+
+    manifest = {'columns': X.columns, 'partitions': {}}
+    codes, uniques = pd.factorize(keys, sort=True)
+    for code, key in enumerate(uniques):
+        rows = np.flatnonzero(codes == code)
+        name = partition_name(key)
+        save_partition(os.path.join(out_dir, name), X.take(rows), y[rows])
+        manifest['partitions'][name] = len(rows)
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def read_manifest(store_dir):
+    """Manifest of a feature store (partitions, row counts, feature columns)"""
+    with open(os.path.join(store_dir, 'manifest.json')) as f:
+        return json.load(f)
+
+
+def write_manifest(store_dir, manifest):
+    """Replace the manifest in one step, so a crash never leaves a half written one"""
+    tmp_path = os.path.join(store_dir, 'manifest.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(store_dir, 'manifest.json'))
+
+
+def append_partition(store_dir, X, prices, horizon=4, quantile=0.5):
+    """Add the design matrix of one or more new quarters (e.g. from FeatureEngine.update_design) to a per date store
+
+    prices : prccq of the rows of X, indexed like X
+
+    The targets of a quarter look `horizon` quarters ahead (see make_labels), so a new quarter is
+    kept as a pending partition (features + prices, not read by BatchStream) until the prices of
+    `horizon` quarters later have been appended, then its labels are computed from the pending
+    prices alone, the unlabelled rows dropped and the partition added to the manifest."""
+    if os.path.isfile(os.path.join(store_dir, 'manifest.json')):
+        manifest = read_manifest(store_dir)
+        if (manifest.get('horizon'), manifest.get('quantile')) != (horizon, quantile):
+            raise ValueError('the store was written w/ horizon={0}, quantile={1}'.format(
+                manifest.get('horizon'), manifest.get('quantile')))
+        if manifest['columns'] != X.columns:
+            raise ValueError('the design matrix columns differ from the columns of the store')
+    else:
+        os.makedirs(store_dir, exist_ok=True)
+        manifest = {'columns': X.columns, 'partitions': {}, 'pending': {}, 'horizon': horizon, 'quantile': quantile}
+
+    # new quarters: pending partitions w/ their prices
+    prices = np.asarray(prices.reindex(X.index), dtype=np.float64)
+    codes, uniques = pd.factorize(X.index.get_level_values('date'), sort=True)
+    for code, key in enumerate(uniques):
+        name = partition_name(key)
+        if name in manifest['partitions'] or name in manifest['pending']:
+            raise ValueError('quarter {0} is already in the store'.format(name))
+        rows = np.flatnonzero(codes == code)
+        path = os.path.join(store_dir, name)
+        save_partition(path, X.take(rows), np.full(len(rows), np.nan))
+        np.save(os.path.join(path, 'prccq.npy'), prices[rows])
+        manifest['pending'][name] = len(rows)
+
+    # labels of the pending quarters whose forward prices have all arrived
+    pending = {name: load_partition(os.path.join(store_dir, name), manifest['columns'])[0]
+               for name in sorted(manifest['pending'])}
+    index = pd.MultiIndex.from_arrays(
+        [np.concatenate([X_p.index.get_level_values('tic') for X_p in pending.values()]),
+         pd.DatetimeIndex(np.concatenate([X_p.index.get_level_values('date').values for X_p in pending.values()]))],
+        names=['tic', 'date'])
+    df1 = pd.DataFrame({'prccq': np.concatenate([np.load(os.path.join(store_dir, name, 'prccq.npy'))
+                                                 for name in pending])}, index=index)
+    labels = make_labels(df1, horizon, quantile).to_numpy().astype(np.float32)
+    quarters = quarter_number(index)
+    last = quarters.max()
+    start = 0
+    for name, X_p in pending.items():
+        y = labels[start:start + len(X_p.index)]
+        ready = quarters[start] + horizon <= last
+        start += len(X_p.index)
+        if not ready:
+            continue
+        labelled = ~np.isnan(y)
+        path = os.path.join(store_dir, name)
+        shutil.rmtree(path + '.tmp', ignore_errors=True)
+        save_partition(path + '.tmp', X_p.take(labelled), y[labelled])
+        shutil.rmtree(path)
+        os.rename(path + '.tmp', path)
+        del manifest['pending'][name]
+        manifest['partitions'][name] = int(labelled.sum())
+    write_manifest(store_dir, manifest)
+    return manifest
+
+
+def write_partitions(store_dir, partitions_dir, engine, warmup=1, horizon=4, quantile=0.5):
+    """Write a feature store quarter by quarter from the per date partitions of ingest.py (see stream_designs)"""
+    manifest = None
+    for df0, X in stream_designs(partitions_dir, engine, warmup):
+        manifest = append_partition(store_dir, X, df0['prccq'], horizon, quantile)
+    return manifest
+
+
+class BatchStream(object):
+    """Shuffled (features + nil? indicators, target) float32 batches streamed from a feature store
+
+    Partitions are read by `workers` threads in a shuffled order every epoch, their rows go
+    through a shuffle buffer of `shuffle_buffer` rows and a background thread keeps `prefetch`
+    finished batches ready. Iterating yields one epoch (or forever w/ repeat=True, for keras fit
+    w/ steps_per_epoch)."""
+
+    def __init__(self, store_dir, partitions=None, batch_size=32, shuffle=True, shuffle_buffer=SHUFFLE_BUFFER,
+                 prefetch=PREFETCH, workers=2, repeat=False, seed=0):
+        self.store_dir = store_dir
+        manifest = read_manifest(store_dir)
+        self.columns = manifest['columns']
+        self.partitions = sorted(manifest['partitions']) if partitions is None else list(partitions)
+        self.n_rows = sum(manifest['partitions'][name] for name in self.partitions)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.prefetch = prefetch
+        self.workers = workers
+        self.repeat = repeat
+        self.seed = seed
+
+    @property
+    def n_features(self):
+        """Width of the dense model input"""
+        return 2 * len(self.columns)
+
+    def steps(self):
+        """Number of batches per epoch"""
+        return -(-self.n_rows // self.batch_size)
+
+    def _load(self, name):
+        X, y = load_partition(os.path.join(self.store_dir, name), self.columns)
+        return X.to_dense(), np.asarray(y)
+
+    def _load_ahead(self, pool, names):
+        """Load partitions in order w/ at most `workers` reads in flight (unlike pool.map, which reads everything at once)"""
+        pending = deque()
+        for name in names:
+            pending.append(pool.submit(self._load, name))
+            if len(pending) > self.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def _epoch(self, rng):
+        """Batches of one epoch: partitions loaded in threads, rows shuffled in the buffer"""
+        order = rng.permutation(self.partitions) if self.shuffle else self.partitions
+        buffer_X, buffer_y, n_buffered = [], [], 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for X, y in self._load_ahead(pool, order):
+                buffer_X.append(X)
+                buffer_y.append(y)
+                n_buffered += len(y)
+                if n_buffered >= self.shuffle_buffer:
+                    buffer_X, buffer_y, n_buffered = yield from self._drain(buffer_X, buffer_y, rng, final=False)
+        yield from self._drain(buffer_X, buffer_y, rng, final=True)
+
+    def _drain(self, buffer_X, buffer_y, rng, final):
+        """Yield full batches of the shuffled buffer, return the leftover rows (all rows if final)"""
+        if not buffer_y:
+            return [], [], 0
+        X, y = np.concatenate(buffer_X), np.concatenate(buffer_y)
+        if self.shuffle:
+            perm = rng.permutation(len(y))
+            X, y = X[perm], y[perm]
+        n_out = len(y) if final else len(y) - len(y) % self.batch_size
+        for start in range(0, n_out, self.batch_size):
+            stop = min(start + self.batch_size, n_out)
+            yield X[start:stop], y[start:stop]
+        return [X[n_out:]], [y[n_out:]], len(y) - n_out
+
+    def _produce(self, out, stop):
+        """Background thread: put the batches of every epoch on the queue, then None (or the exception)"""
+        rng = np.random.RandomState(self.seed)
+        try:
+            while not stop.is_set():
+                for batch in self._epoch(rng):
+                    out.put(batch)
+                    if stop.is_set():
+                        return
+                if not self.repeat:
+                    break
+            out.put(None)
+        except Exception as exc:
+            out.put(exc)
+
+    def __iter__(self):
+        out = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(out, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                batch = out.get()
+                if batch is None:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            # unblock the producer if it waits on a full queue
+            while producer.is_alive():
+                try:
+                    out.get_nowait()
+                except queue.Empty:
+                    producer.join(0.01)
+
+    def tf_dataset(self):
+        """The stream as a tf.data.Dataset (tensorflow prefetches on top of the background thread)"""
+        import tensorflow as tf
+        signature = (tf.TensorSpec(shape=(None, self.n_features), dtype=tf.float32),
+                     tf.TensorSpec(shape=(None,), dtype=tf.float32))
+        return tf.data.Dataset.from_generator(self.__iter__, output_signature=signature).prefetch(tf.data.AUTOTUNE)
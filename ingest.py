@@ -0,0 +1,120 @@
+"""Streaming ingestion of a compustat export: reads the csv in chunks w/ an explicit dtype map and writes
+the prepared rows as per ticker or per date partitions, so no step ever needs the whole file in memory"""
+
+import os
+from itertools import islice
+
+import pandas as pd
+
+from data_cache import load_frame, save_frame
+from feature_engine import prepare
+
+# rows per chunk read from the csv
+CHUNKSIZE = 200000
+
+# rows read to find which fundamental columns are numeric
+SNIFF_ROWS = 1000
+
+# rows buffered over all partitions before the buffers are written, one part per partition
+BUFFER_ROWS = 1000000
+
+
+def ingest_columns(filename, drop_cols=(), date_source='datadate', sniff_rows=SNIFF_ROWS):
+    """Columns to read and their dtypes: float32 for the fundamentals, categorical for tic
+
+    The leading identifier columns (gvkey, indfmt, popsrc, ...) and non-numeric fundamentals
+    (costat) are never read"""
+    sample = pd.read_csv(filename, nrows=sniff_rows)
+    columns = list(sample.columns)
+    fundamental_cols = [col for col in columns[columns.index('actq'):]
+                        if col not in drop_cols and pd.api.types.is_numeric_dtype(sample[col])]
+
+    dtype = {'tic': 'category', 'datadate': 'int64'}
+    dtype.update({col: 'float32' for col in fundamental_cols})
+    usecols = ['tic', 'datadate'] + fundamental_cols
+    if date_source != 'datadate':
+        dtype[date_source] = 'category'
+        usecols.insert(2, date_source)
+    return usecols, dtype
+
+
+def read_chunks(filename, drop_cols=(), date_source='datadate', chunksize=CHUNKSIZE):
+    """Yield the prepared (tic, date) indexed float32 frame of every chunk of the csv
+
+    tic stays categorical (codes + the chunk's symbols), save_frame stores it as such"""
+    usecols, dtype = ingest_columns(filename, drop_cols, date_source)
+    for chunk in pd.read_csv(filename, usecols=usecols, dtype=dtype, chunksize=chunksize):
+        yield prepare(chunk, date_source=date_source)
+
+
+def partition_name(key):
+    """Directory name of a partition key (ticker symbol or quarter date)"""
+    if isinstance(key, pd.Timestamp):
+        return key.strftime('%Y-%m-%d')
+    return str(key).replace(os.sep, '_')
+
+
+def ingest(filename, out_dir, partition_by='date', drop_cols=(), date_source='datadate', chunksize=CHUNKSIZE,
+           buffer_rows=BUFFER_ROWS):
+    """Stream a compustat export into out_dir/<partition>/part-<n> frames, partition_by = 'date' or 'tic'
+
+    Rows are buffered per partition and written once buffer_rows rows are held in total, so a
+    partition gets one part per buffer_rows rows of the export, not one per chunk (the export is
+    sorted by gvkey, so every chunk touches every date). Per date partitions are what
+    stream_features reads; per ticker partitions mean one directory per ticker.
+
+    Returns the list of partition names"""
+    if partition_by not in ('tic', 'date'):
+        raise ValueError('partition_by must be tic or date, not {0}'.format(partition_by))
+    parts, buffers, buffered = {}, {}, 0
+
+    def flush():
+        for name, frames in buffers.items():
+            os.makedirs(os.path.join(out_dir, name), exist_ok=True)
+            path = os.path.join(out_dir, name, 'part-{0:05d}'.format(parts.get(name, 0)))
+            save_frame(pd.concat(frames).sort_index(), path)
+            parts[name] = parts.get(name, 0) + 1
+        buffers.clear()
+
+    for chunk in read_chunks(filename, drop_cols, date_source, chunksize):
+        for key, rows in chunk.groupby(level=partition_by, sort=False, observed=True):
+            buffers.setdefault(partition_name(key), []).append(rows)
+        buffered += len(chunk)
+        if buffered >= buffer_rows:
+            flush()
+            buffered = 0
+    flush()
+    return sorted(parts)
+
+
+def load_partition(out_dir, name, mmap=True):
+    """Prepared frame of one partition (all of its chunk parts)"""
+    path = os.path.join(out_dir, name)
+    parts = [load_frame(os.path.join(path, part), mmap) for part in sorted(os.listdir(path))]
+    if len(parts) == 1:
+        return parts[0]
+    return pd.concat(parts).sort_index()
+
+
+def iter_partitions(out_dir, mmap=True):
+    """Yield (name, frame) for every partition in out_dir, in name order"""
+    for name in sorted(os.listdir(out_dir)):
+        yield name, load_partition(out_dir, name, mmap)
+
+
+def stream_designs(out_dir, engine, warmup=1):
+    """Yield (prepared rows, design matrix) quarter by quarter from per date partitions
+
+    The first warmup quarters are built in one go, every later quarter goes through
+    engine.update_design so only the engine's trailing state is kept in memory"""
+    partitions = iter_partitions(out_dir)
+    first = pd.concat([frame for _, frame in islice(partitions, warmup)]).sort_index()
+    yield first, engine.build(first)[1]
+    for _, frame in partitions:
+        yield frame, engine.update_design(frame)
+
+
+def stream_features(out_dir, engine, warmup=1):
+    """Yield the feature frame quarter by quarter from per date partitions (see stream_designs)"""
+    for _, design in stream_designs(out_dir, engine, warmup):
+        yield design.to_frame()
@@ -0,0 +1,89 @@
+"""Keras models shared by the training scripts, the walk-forward runner and the sweeps"""
+
+from keras.callbacks import EarlyStopping
+from keras.layers import GRU, LSTM, Dense, Input
+from keras.models import Sequential
+from keras.optimizers import Adam
+
+# model_1 of the scripts + the training settings they use
+DEFAULT_CONFIG = {'layers': (200, 200, 100),
+                  'kernel_initializer': 'uniform',
+                  'learning_rate': None,
+                  'epochs': 10,
+                  'patience': 2,
+                  'batch_size': 32,
+                  'validation_split': 0.1}
+
+# recurrent model settings (see build_rnn), training settings as above
+RNN_CONFIG = dict(DEFAULT_CONFIG, units=(64,), cell='lstm', lookback=4)
+
+RNN_CELLS = {'lstm': LSTM, 'gru': GRU}
+
+
+def compile_model(model, learning_rate=None):
+    """Compile a binary classifier w/ adam (default learning rate unless given) and binary crossentropy"""
+    optimizer = 'adam' if learning_rate is None else Adam(learning_rate=learning_rate)
+    model.compile(optimizer=optimizer, loss='binary_crossentropy', metrics=['accuracy'])
+    return model
+
+
+def build_mlp(n_cols, layers=(200, 200, 100), kernel_initializer='uniform', learning_rate=None):
+    """Instantiate and compile the MLP: relu Dense layers of the given widths + one sigmoid output unit"""
+    model = Sequential()
+    model.add(Dense(layers[0], activation='relu', kernel_initializer=kernel_initializer, input_shape=(n_cols,)))
+    for width in layers[1:]:
+        model.add(Dense(width, activation='relu', kernel_initializer=kernel_initializer))
+    model.add(Dense(1, activation='sigmoid', kernel_initializer=kernel_initializer))
+    return compile_model(model, learning_rate)
+
+
+def train_mlp(X_train, y_train, config=None, validation_data=None):
+    """Build and fit an MLP w/ early stopping on the validation loss : (model, history)
+
+    w/o validation_data the last validation_split of the rows is held out, so pass the rows in date
+    order to validate on the most recent quarters"""
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    model = build_mlp(X_train.shape[1], config['layers'], config['kernel_initializer'], config['learning_rate'])
+    early_stopping_monitor = EarlyStopping(patience=config['patience'])
+    fit_args = {'validation_data': validation_data} if validation_data is not None \
+        else {'validation_split': config['validation_split']}
+    history = model.fit(X_train, y_train, epochs=config['epochs'], batch_size=config['batch_size'],
+                        callbacks=[early_stopping_monitor], verbose=0, **fit_args)
+    return model, history
+
+
+def build_rnn(lookback, n_features, units=(64,), cell='lstm', learning_rate=None):
+    """Instantiate and compile the RNN: stacked LSTM/GRU layers over (lookback, features) sequences + one sigmoid output unit"""
+    layer = RNN_CELLS[cell]
+    model = Sequential()
+    model.add(Input(shape=(lookback, n_features)))
+    for i, width in enumerate(units):
+        model.add(layer(width, return_sequences=i < len(units) - 1))
+    model.add(Dense(1, activation='sigmoid'))
+    return compile_model(model, learning_rate)
+
+
+def train_rnn(train, validation, config=None):
+    """Build and fit an RNN on sequence datasets (see sequences.py), fed batch by batch : (model, history)"""
+    config = dict(RNN_CONFIG, **(config or {}))
+    batch_size = config['batch_size']
+    model = build_rnn(train.lookback, train.dense.shape[1], config['units'], config['cell'], config['learning_rate'])
+    early_stopping_monitor = EarlyStopping(patience=config['patience'])
+    history = model.fit(train.batches(batch_size), steps_per_epoch=train.steps(batch_size),
+                        validation_data=validation.batches(batch_size, shuffle=False),
+                        validation_steps=validation.steps(batch_size),
+                        epochs=config['epochs'], callbacks=[early_stopping_monitor], verbose=0)
+    return model, history
+
+
+def train_mlp_stream(train, validation, config=None):
+    """Build and fit an MLP on batch streams of a feature store (see feature_store.py) : (model, history)
+
+    The streams must repeat (BatchStream(..., repeat=True)), keras takes steps() batches per epoch"""
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    model = build_mlp(train.n_features, config['layers'], config['kernel_initializer'], config['learning_rate'])
+    early_stopping_monitor = EarlyStopping(patience=config['patience'])
+    history = model.fit(iter(train), steps_per_epoch=train.steps(), validation_data=iter(validation),
+                        validation_steps=validation.steps(), epochs=config['epochs'],
+                        callbacks=[early_stopping_monitor], verbose=0)
+    return model, history
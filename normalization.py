@@ -0,0 +1,180 @@
+"""Fit/transform normalization of the fundamental items, w/ statistics that can be saved to disk and reused for scoring"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+METHODS = ('frobenius', 'column', 'date', 'rolling')
+
+
+def date_aggregates(df):
+    """Per date count, sum and sum of squares of the finite values of every column"""
+    finite = df.where(np.isfinite(df.to_numpy(dtype=float)))
+    grouped = finite.groupby(level='date')
+    return grouped.count().astype(float), grouped.sum(), (finite ** 2).groupby(level='date').sum()
+
+
+def add_cumulative(cum, new):
+    """Running (cumulative over the sorted dates) aggregates w/ the per date aggregates `new` added
+
+    Only the dates from the first date of `new` on are recomputed, so adding the latest quarter
+    costs one row whatever the length of the history"""
+    new = new.sort_index()
+    if cum is None:
+        return new.cumsum()
+    k = cum.index.searchsorted(new.index[0])
+    head, tail = cum.iloc[:k], cum.iloc[k:]
+    before = head.iloc[-1] if k else 0
+    # back to per date aggregates for the dates that are recomputed
+    per_date = tail - tail.shift(1).fillna(before)
+    per_date = per_date.add(new, fill_value=0).sort_index()
+    return pd.concat([head, per_date.cumsum() + before])
+
+
+def per_date(cum):
+    """Per date aggregates of running aggregates"""
+    return cum.diff().fillna(cum.iloc[:1])
+
+
+class Normalizer(object):
+    """Normalization of the fundamental items
+
+    method = 'frobenius' : divide by the Frobenius norm of the fitted rows (the original normalization)
+             'column'    : z-score w/ the mean and std of every column over the fitted rows
+             'date'      : z-score w/ the mean and std of every column over the same date (cross-sectional),
+                           needs no fitting
+             'rolling'   : z-score w/ the mean and std of every column over the last `window` dates up to
+                           and including the row's date (all dates so far if window is None)
+
+    frobenius and column statistics are frozen after fit(), rolling statistics are running per date
+    count / sum / sum of squares extended by partial_fit() as new quarters land, a window is the
+    difference of two running rows. transform() only looks up the statistics of the dates it scales,
+    so scoring a new quarter never goes back over the full history and no row is scaled w/ data from
+    a later date unless it was fitted on it (frobenius, column)."""
+
+    def __init__(self, method='rolling', window=None):
+        if method not in METHODS:
+            raise ValueError('unknown normalization method: {0}'.format(method))
+        self.method = method
+        self.window = window
+        self.columns = None
+        self.norm = None
+        self.mean = None
+        self.std = None
+        self.count = self.sum = self.sumsq = None
+
+    def fit(self, df):
+        """Fit the statistics on df, replacing any previous fit"""
+        self.columns = list(df.columns)
+        self.count = self.sum = self.sumsq = None
+        values = df.to_numpy(dtype=float)
+        if self.method == 'frobenius':
+            self.norm = float(np.linalg.norm(values))
+        elif self.method == 'column':
+            self.mean = np.nanmean(np.where(np.isfinite(values), values, np.nan), axis=0)
+            self.std = np.nanstd(np.where(np.isfinite(values), values, np.nan), axis=0)
+        elif self.method == 'rolling':
+            self.partial_fit(df)
+        return self
+
+    def partial_fit(self, df):
+        """Add the dates of df to the rolling statistics (frobenius, column and date statistics stay as they are)"""
+        if self.columns is None:
+            self.columns = list(df.columns)
+        if self.method != 'rolling':
+            return self
+        # a quarter can land in several batches, its aggregates just add up
+        count, total, sumsq = date_aggregates(df[self.columns])
+        self.count = add_cumulative(self.count, count)
+        self.sum = add_cumulative(self.sum, total)
+        self.sumsq = add_cumulative(self.sumsq, sumsq)
+        return self
+
+    def fit_aggregates(self, columns, count, total, sumsq):
+        """Fit the rolling statistics from per date aggregates (see date_aggregates), e.g. computed on
+        shards of whole dates (see parallel.py), replacing any previous fit"""
+        self.columns = list(columns)
+        self.count, self.sum, self.sumsq = (add_cumulative(None, agg) for agg in (count, total, sumsq))
+        return self
+
+    def window_sums(self, cum, dates):
+        """Sums over the window ending at every date (NaN for dates that were not fitted) of running aggregates"""
+        values = cum.to_numpy()
+        pos = cum.index.get_indexer(dates)
+        found = pos >= 0
+        out = np.full((len(dates), values.shape[1]), np.nan)
+        out[found] = values[pos[found]]
+        if self.window:
+            start = pos - self.window
+            earlier = found & (start >= 0)
+            out[earlier] -= values[start[earlier]]
+        return pd.DataFrame(out, index=dates, columns=cum.columns)
+
+    def date_stats(self, df):
+        """Mean and std of the dates of df (rolling: from the running aggregates, date: from df itself)"""
+        if self.method == 'date':
+            count, total, sumsq = date_aggregates(df[self.columns])
+        else:
+            dates = df.index.get_level_values('date').unique()
+            count, total, sumsq = (self.window_sums(cum, dates) for cum in (self.count, self.sum, self.sumsq))
+        mean = total / count
+        std = np.sqrt((sumsq / count - mean ** 2).clip(lower=0))
+        return mean, std
+
+    def transform(self, df):
+        """Normalize df w/ the fitted statistics"""
+        if self.columns is None:
+            raise ValueError('Normalizer must be fitted before transform')
+        df = df[self.columns]
+        if self.method == 'frobenius':
+            return df / self.norm
+        if self.method == 'column':
+            mean, std = self.mean, self.std
+        else:
+            # look up the statistics of every row's date
+            date_mean, date_std = self.date_stats(df)
+            dates = df.index.get_level_values('date')
+            mean = date_mean.reindex(dates).to_numpy()
+            std = date_std.reindex(dates).to_numpy()
+        std = np.where(std > 0, std, 1.0)
+        return pd.DataFrame((df.to_numpy(dtype=float) - mean) / std, index=df.index, columns=df.columns)
+
+    def fit_transform(self, df):
+        """Fit on df, then normalize it"""
+        return self.fit(df).transform(df)
+
+    def save(self, path):
+        """Write the fitted statistics to a json file"""
+        state = {'method': self.method, 'window': self.window, 'columns': self.columns}
+        if self.method == 'frobenius':
+            state['norm'] = self.norm
+        elif self.method == 'column':
+            state['mean'] = self.mean.tolist()
+            state['std'] = self.std.tolist()
+        elif self.method == 'rolling' and self.count is not None:
+            state['dates'] = [d.strftime('%Y-%m-%d') for d in self.count.index]
+            state['count'] = per_date(self.count).to_numpy().tolist()
+            state['sum'] = per_date(self.sum).to_numpy().tolist()
+            state['sumsq'] = per_date(self.sumsq).to_numpy().tolist()
+        with open(path, 'w') as f:
+            json.dump(state, f)
+
+    @classmethod
+    def load(cls, path):
+        """Read a normalizer written by save()"""
+        with open(path) as f:
+            state = json.load(f)
+        normalizer = cls(state['method'], state['window'])
+        normalizer.columns = state['columns']
+        if normalizer.method == 'frobenius':
+            normalizer.norm = state['norm']
+        elif normalizer.method == 'column':
+            normalizer.mean = np.array(state['mean'], dtype=float)
+            normalizer.std = np.array(state['std'], dtype=float)
+        elif 'dates' in state:
+            dates = pd.DatetimeIndex(state['dates'], name='date')
+            frame = lambda key: pd.DataFrame(np.array(state[key], dtype=float), index=dates,
+                                             columns=normalizer.columns).cumsum()
+            normalizer.count, normalizer.sum, normalizer.sumsq = frame('count'), frame('sum'), frame('sumsq')
+        return normalizer
@@ -0,0 +1,200 @@
+"""Parallel build of the base frame and the design matrix: the rows are sharded across a process pool
+
+The per ticker stages (price changes and valuation features, forward fills, 1yr log changes, the
+normalization of the fundamentals, the feature fill and the nil? mask) run on shards of whole
+tickers, the cross-sectional stages (per date ranks, the per date sums of the rolling normalizer)
+on shards of whole dates, all in forked worker processes. The workers inherit the prepared frame
+through fork and write their rows straight into arrays in anonymous shared memory, which the parent
+wraps as df1, df2 and the design matrix w/o copying, so no frame is pickled or written to disk and
+the parent only combines the per date sums. Every stage runs the same functions as the serial path
+(see feature_engine.py) on the same values and dtypes, so the result is identical to
+FeatureEngine.build w/o workers."""
+
+import mmap
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from design import DesignMatrix
+from feature_engine import (BASE_FEATURES, base_columns, date_features, fill_base, fill_features, fundamentals,
+                            one_year_changes, ticker_features)
+from normalization import date_aggregates
+from profiling import Profiler
+from registry import FEATURES, resolve, role
+
+# shards per worker, so a few large tickers (or dates) do not leave the other workers idle
+SHARDS_PER_WORKER = 4
+
+# stages of build_sharded that run in the worker processes, the other stages run in the parent alone
+WORKER_STAGES = ('ticker features', 'ranks', 'fill ranks', 'date sums', 'design rows')
+
+# prepared frame and shared arrays of the running build, inherited by the forked workers
+SHARED = {}
+
+
+def row_shards(codes, n_shards):
+    """(start, stop) row ranges of about equal size that never split a key, over rows sorted by key code (tic, date)"""
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    targets = np.linspace(0, len(codes), n_shards + 1)[1:-1]
+    cuts = np.unique(np.r_[0, starts[np.minimum(np.searchsorted(starts, targets), len(starts) - 1)], len(codes)])
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def shared_array(shape, dtype):
+    """Zeroed array in anonymous shared memory: what a forked worker writes to it, the parent sees"""
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    buffer = mmap.mmap(-1, max(size * dtype.itemsize, 1))
+    return np.frombuffer(buffer, dtype=dtype, count=size).reshape(shape)
+
+
+def shared_frame(dtypes, n_rows):
+    """{column: shared array of n_rows} for the columns / dtypes of a frame, one (columns x rows) block per dtype"""
+    layout = {}
+    for col, dtype in dtypes.items():
+        layout.setdefault(dtype, []).append(col)
+    arrays = {}
+    for dtype, cols in layout.items():
+        arrays.update(zip(cols, shared_array((len(cols), n_rows), dtype)))
+    return arrays
+
+
+def frame_of(arrays, columns, index, rows=slice(None)):
+    """Frame over the rows (slice, w/o copying, or positions) of shared column arrays"""
+    return pd.DataFrame({col: arrays[col][rows] for col in columns}, index=index, copy=False)
+
+
+def write_columns(arrays, rows, df):
+    """Write the columns of df into the rows (slice or positions) of shared column arrays"""
+    for col in df.columns:
+        arrays[col][rows] = df[col].to_numpy()
+
+
+def date_rows(start, stop):
+    """Row positions and index of a shard of whole dates"""
+    rows = SHARED['date_order'][start:stop]
+    return rows, SHARED['df0'].index[rows]
+
+
+def shard_ticker_features(start, stop, features):
+    """Worker: row / per ticker features of a shard (price changes, valuation features, ...) and their forward fill"""
+    df1 = ticker_features(SHARED['df0'].iloc[start:stop], features)[SHARED['ticker_cols']]
+    write_columns(SHARED['df1'], slice(start, stop), df1)
+    write_columns(SHARED['df2'], slice(start, stop), fill_base(df1))
+
+
+def shard_date_features(start, stop, features):
+    """Worker: per date features (percentile ranks, ...) of a shard of whole dates"""
+    rows, index = date_rows(start, stop)
+    write_columns(SHARED['df1'], rows, date_features(frame_of(SHARED['df1'], SHARED['date_inputs'], index, rows),
+                                                     features))
+
+
+def shard_fill_date_features(start, stop):
+    """Worker: forward fill of the per date features of a shard of whole tickers"""
+    rows = slice(start, stop)
+    df1 = frame_of(SHARED['df1'], SHARED['date_cols'], SHARED['df0'].index[rows], rows)
+    write_columns(SHARED['df2'], rows, fill_base(df1))
+
+
+def shard_date_sums(start, stop):
+    """Worker: per date count, sum and sum of squares of the filled fundamentals of a shard of whole dates"""
+    rows, index = date_rows(start, stop)
+    return date_aggregates(fundamentals(frame_of(SHARED['df2'], SHARED['columns'], index, rows)))
+
+
+def shard_design(start, stop, normalizer, n_chg, n_ranks):
+    """Worker: design matrix rows of a shard of whole tickers (1yr log changes | ranks | normalized fundamentals),
+    then their nil? mask and fill; normalizer is None if the parent already wrote the normalized block"""
+    rows = slice(start, stop)
+    index = SHARED['df0'].index[rows]
+    df3 = fundamentals(frame_of(SHARED['df2'], SHARED['columns'], index, rows))
+    features = SHARED['features'][rows]
+    features[:, :n_chg] = one_year_changes(df3).to_numpy()
+    features[:, n_chg:n_chg + n_ranks] = frame_of(SHARED['df1'], SHARED['rank_cols'], index, rows).to_numpy()
+    if normalizer is not None:
+        features[:, n_chg + n_ranks:] = normalizer.transform(df3).to_numpy()
+    SHARED['mask'][rows] = fill_features(features, SHARED['tic_codes'][rows])
+
+
+def run_shards(pool, func, shards, *args):
+    """Run func(start, stop, *args) for every shard in the pool : results, re-raising the first worker error"""
+    return [future.result() for future in [pool.submit(func, start, stop, *args) for start, stop in shards]]
+
+
+def build_sharded(df0, normalizer, workers, profiler=None, features=BASE_FEATURES):
+    """Build (df1, df2, design) of the derived `features` from a prepared frame, sharded across `workers` processes
+
+    Fits the normalizer like the serial path. The workers are forked (so this needs a platform w/
+    fork), the returned frames and design matrix live in shared memory"""
+    stage = (profiler or Profiler()).stage
+    n_rows = len(df0)
+    n_shards = workers * SHARDS_PER_WORKER
+    tic_codes = df0.index.codes[df0.index.names.index('tic')].astype(np.int64)
+    date_codes = pd.factorize(df0.index.get_level_values('date'), sort=True)[0]
+    date_order = np.argsort(date_codes, kind='stable')
+    ticker_shards = row_shards(tic_codes, n_shards)
+    date_shards = row_shards(date_codes[date_order], n_shards)
+
+    # column dtypes of the intermediate frames, from their first row
+    columns = base_columns(df0.columns, features)
+    probe_ticker = ticker_features(df0.iloc[:1], features)
+    probe_base = pd.concat([probe_ticker, date_features(probe_ticker, features)], axis='columns')[columns]
+    probe_filled = fill_base(probe_base)
+    date_cols = [col for col in columns if col in FEATURES and FEATURES[col].kind == 'date']
+    ticker_cols = [col for col in columns if col not in date_cols]
+    # per ticker columns the per date features are computed from
+    needed = {col for level in resolve(date_cols, set(ticker_cols)) for name in level for col in FEATURES[name].inputs}
+    date_inputs = [col for col in ticker_cols if col in needed]
+
+    # design matrix blocks: 1yr log changes | ranks | normalized fundamentals
+    df3 = fundamentals(probe_filled)
+    chg_cols = list(one_year_changes(df3).columns)
+    rank_cols = [col for col in columns if role(col) == 'rank']
+    design_columns = [name + '_1yr_chg' for name in chg_cols] + rank_cols + ['norm:' + name for name in df3.columns]
+    n_chg, n_ranks = len(chg_cols), len(rank_cols)
+
+    SHARED.update(df0=df0, tic_codes=tic_codes, date_order=date_order, columns=columns, ticker_cols=ticker_cols,
+                  date_cols=date_cols, date_inputs=date_inputs, rank_cols=rank_cols,
+                  df1=shared_frame(probe_base.dtypes, n_rows), df2=shared_frame(probe_filled.dtypes, n_rows),
+                  features=shared_array((n_rows, len(design_columns)), np.float32),
+                  mask=shared_array((n_rows, -(-len(design_columns) // 8)), np.uint8))
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            # per ticker: price changes, valuation features, ... and their forward fill
+            with stage('ticker features', n_rows):
+                run_shards(pool, shard_ticker_features, ticker_shards, features)
+
+            # per date: percentile ranks (over all tickers of the date), then per ticker: their forward fill
+            with stage('ranks', n_rows):
+                run_shards(pool, shard_date_features, date_shards, features)
+            with stage('fill ranks', n_rows):
+                run_shards(pool, shard_fill_date_features, ticker_shards)
+            df1 = frame_of(SHARED['df1'], columns, df0.index)
+            df2 = frame_of(SHARED['df2'], columns, df0.index)
+
+            # normalizer statistics: the rolling ones are per date sums, the others need all rows at once;
+            # only the 'date' method also needs all tickers of a date to transform
+            if normalizer.method == 'rolling':
+                with stage('date sums', n_rows):
+                    sums = run_shards(pool, shard_date_sums, date_shards)
+                with stage('fit normalizer', n_rows):
+                    normalizer.fit_aggregates(fundamentals(probe_filled).columns,
+                                              *(pd.concat(parts) for parts in zip(*sums)))
+            else:
+                with stage('fit normalizer', n_rows):
+                    normalizer.fit(fundamentals(df2))
+            if normalizer.method == 'date':
+                with stage('normalize', n_rows):
+                    SHARED['features'][:, n_chg + n_ranks:] = normalizer.transform(fundamentals(df2)).to_numpy()
+
+            # per ticker: 1yr log changes, ranks and normalized fundamentals into the design matrix, nil? mask, fill
+            with stage('design rows', n_rows):
+                run_shards(pool, shard_design, ticker_shards, None if normalizer.method == 'date' else normalizer,
+                           n_chg, n_ranks)
+            design = DesignMatrix(SHARED['features'], SHARED['mask'], df0.index, design_columns)
+    finally:
+        SHARED.clear()
+    return df1, df2, design
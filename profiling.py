@@ -0,0 +1,120 @@
+"""Stage level profiling of the feature and training pipeline: wall time, peak RSS and rows/sec of every named stage
+
+A Profiler is passed through the pipeline (FeatureEngine(profiler=...), assemble_design, profile_pipeline),
+every step runs inside `with profiler.stage(name, rows):` and the records end up in a report table
+or a json file that can be compared between runs."""
+
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+def peak_rss():
+    """Peak resident set size of the process in bytes (None where the platform does not report it)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Profiler(object):
+    """Records wall time, peak RSS and rows/sec of named pipeline stages
+
+    Peak RSS is the process high-water mark at the end of a stage, so a stage only raises it if it
+    needed more memory than everything before it. trace_memory=True also records each stage's own
+    peak of python / numpy allocations (tracemalloc, which slows the stages down)."""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """Time the body of the with block as stage `name` that processes `rows` rows
+
+        Yields the stage's record, so rows that are only known inside the block can be set there"""
+        record = {'stage': name, 'rows': rows}
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        elif self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            record['seconds'] = seconds
+            record['rows_per_sec'] = record['rows'] / seconds if record['rows'] and seconds > 0 else None
+            record['peak_rss_mb'] = None if resource is None else peak_rss() / 2.0 ** 20
+            if self.trace_memory:
+                record['alloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2.0 ** 20
+            if tracing:
+                tracemalloc.stop()
+            self.records.append(record)
+
+    def report(self):
+        """Records as a frame, one row per stage in the order they ran"""
+        columns = ['stage', 'seconds', 'rows', 'rows_per_sec', 'peak_rss_mb']
+        if self.trace_memory:
+            columns.append('alloc_peak_mb')
+        return pd.DataFrame(self.records, columns=columns)
+
+    def save(self, path, **meta):
+        """Write the records (+ e.g. the data size or git revision as meta) to a json report"""
+        with open(path, 'w') as f:
+            json.dump({'meta': meta, 'stages': self.records}, f, indent=1)
+
+
+def profile_pipeline(filename, drop_cols=(), horizon=4, train=False, profiler=None, config=None):
+    """Run read_csv -> features -> labels (-> MLP fit) on a compustat export w/ every stage profiled : profiler"""
+    from feature_engine import FeatureEngine, make_labels
+
+    profiler = profiler or Profiler()
+    with profiler.stage('read_csv') as record:
+        df = pd.read_csv(filename)
+        record['rows'] = len(df)
+
+    engine = FeatureEngine(drop_cols, profiler=profiler)
+    df1, X = engine.build(df)
+    with profiler.stage('labels', len(df1)):
+        y = make_labels(df1, horizon).to_numpy().astype('float32')
+
+    if train:
+        from models import train_mlp
+
+        labelled = ~np.isnan(y)
+        with profiler.stage('densify', int(labelled.sum())):
+            X_train = X.to_dense(labelled)
+        with profiler.stage('fit', len(X_train)):
+            train_mlp(X_train, y[labelled], config)
+    return profiler
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='profile the feature (and training) pipeline on a compustat export')
+    parser.add_argument('filename')
+    parser.add_argument('--drop-cols', nargs='*', default=[])
+    parser.add_argument('--train', action='store_true', help='also fit the MLP')
+    parser.add_argument('--trace-memory', action='store_true', help='per stage allocation peaks (slower)')
+    parser.add_argument('--out', default=None, help='json file to write the report to')
+    args = parser.parse_args()
+
+    profiler = profile_pipeline(args.filename, args.drop_cols, train=args.train,
+                                profiler=Profiler(args.trace_memory))
+    print(profiler.report().to_string(index=False, float_format='{0:.3f}'.format))
+    if args.out:
+        profiler.save(args.out, filename=args.filename)
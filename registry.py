@@ -0,0 +1,139 @@
+"""Declarative registry of the derived features: every feature states its input columns, its grouping kind
+and how it enters the model inputs, and a FeatureFrame computes only the requested features, in
+dependency order, memoizing every intermediate
+
+kind = 'row'    : computed row by row from the inputs of the same row
+       'ticker' : needs the earlier quarters of the same ticker (price changes, ...)
+       'date'   : needs all tickers of the same date (percentile ranks, ...)
+row and ticker features can be computed on any set of whole tickers (see parallel.py), date features
+need the full cross-section, so they are computed last and nothing but date features may depend on them.
+
+role = 'fundamental' : normalized and 1yr log change in the model inputs (like the raw items)
+       'ratio'       : normalized only (may be negative, no log change)
+       'rank'        : used as is
+       'input'       : only an input of other features, not a model input itself
+
+Features that share a kernel (e.g. all price change horizons, all ranks) and are ready at the same
+time are computed in one call of the kernel."""
+
+import pandas as pd
+
+KINDS = ('row', 'ticker', 'date')
+ROLES = ('fundamental', 'ratio', 'rank', 'input')
+
+# name: Feature
+FEATURES = {}
+
+# name: func(frame of the inputs, [features]) -> frame of the features, for features computed together
+KERNELS = {}
+
+
+class Feature(object):
+    """A derived column: input columns, grouping kind, role in the model inputs and how to compute it
+
+    func(frame of the inputs) -> series, or kernel + args for features computed in a batch"""
+
+    def __init__(self, name, inputs, kind='row', role='fundamental', func=None, kernel=None, args=None):
+        if kind not in KINDS:
+            raise ValueError('unknown feature kind: {0}'.format(kind))
+        if role not in ROLES:
+            raise ValueError('unknown feature role: {0}'.format(role))
+        if (func is None) == (kernel is None):
+            raise ValueError('a feature needs either func or kernel')
+        self.name = name
+        self.inputs = list(inputs)
+        self.kind = kind
+        self.role = role
+        self.func = func
+        self.kernel = kernel
+        self.args = args
+
+
+def register(name, inputs, kind='row', role='fundamental', kernel=None, args=None):
+    """Add a feature to the registry, as a decorator of its func (or called directly w/ a kernel)
+
+        @register('bk_to_mkt', ['shareholders_equity', 'mkt_cap'])
+        def bk_to_mkt(df):
+            return df['shareholders_equity'] / df['mkt_cap']"""
+    for col in inputs:
+        if kind != 'date' and col in FEATURES and FEATURES[col].kind == 'date':
+            raise ValueError('{0} is a {1} feature and cannot depend on the per date feature {2}'.format(name, kind, col))
+
+    def decorator(func):
+        FEATURES[name] = Feature(name, inputs, kind, role, func, kernel, args)
+        return func
+
+    if kernel is not None:
+        FEATURES[name] = Feature(name, inputs, kind, role, kernel=kernel, args=args)
+        return None
+    return decorator
+
+
+def role(name):
+    """Role of a column: registered features have their own, raw items are fundamentals"""
+    return FEATURES[name].role if name in FEATURES else 'fundamental'
+
+
+def resolve(names, available):
+    """Features to compute for `names` given the available columns : list of lists, every list only
+    depends on the available columns and the lists before it"""
+    levels = {}
+
+    def level(name, path):
+        if name in available:
+            return -1
+        if name not in FEATURES:
+            raise KeyError('{0} is neither a column nor a registered feature'.format(name))
+        if name in path:
+            raise ValueError('circular feature dependency: {0}'.format(' -> '.join(path + (name,))))
+        if name not in levels:
+            levels[name] = 1 + max([level(col, path + (name,)) for col in FEATURES[name].inputs] or [-1])
+        return levels[name]
+
+    for name in names:
+        level(name, ())
+    order = [[] for _ in range(max(levels.values()) + 1)] if levels else []
+    for name, n in levels.items():
+        order[n].append(name)
+    return order
+
+
+class FeatureFrame(object):
+    """Features over a prepared (tic, date) frame, computed on first request and memoized
+
+    rank_rows optionally restricts the per date features to a boolean mask of rows (the new
+    quarter of an incremental update), their other rows are NaN"""
+
+    def __init__(self, df, rank_rows=None):
+        self.df = df
+        self.rank_rows = rank_rows
+        self.computed = {}
+
+    def column(self, name):
+        return self.computed[name] if name in self.computed else self.df[name]
+
+    def inputs(self, features):
+        """Frame of the (deduplicated) inputs of a list of features"""
+        cols = list(dict.fromkeys(col for feature in features for col in feature.inputs))
+        return pd.DataFrame({col: self.column(col) for col in cols}, index=self.df.index)
+
+    def compute(self, names):
+        """Frame of the requested features (or raw columns), computing only the ones not known yet"""
+        available = set(self.df.columns) | set(self.computed)
+        for level in resolve(names, available):
+            features = [FEATURES[name] for name in level]
+            batches = {}
+            for feature in features:
+                batches.setdefault(feature.kernel or feature.name, []).append(feature)
+            for key, batch in batches.items():
+                df = self.inputs(batch)
+                subset = batch[0].kind == 'date' and self.rank_rows is not None
+                if subset:
+                    df = df.loc[self.rank_rows]
+                if batch[0].kernel is None:
+                    out = pd.DataFrame({batch[0].name: batch[0].func(df)})
+                else:
+                    out = KERNELS[key](df, batch)
+                for feature in batch:
+                    self.computed[feature.name] = out[feature.name].reindex(self.df.index) if subset else out[feature.name]
+        return pd.DataFrame({name: self.column(name) for name in names}, index=self.df.index)
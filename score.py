@@ -0,0 +1,102 @@
+"""Headless batch scoring: load a saved model and the fitted feature engine, build the features of only the
+requested quarter and score / rank the whole universe in large vectorized batches, w/o retraining anything"""
+
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from feature_engine import FeatureEngine, pct_ranks
+
+MODEL_FILE = 'model.keras'
+ENGINE_DIR = 'engine'
+COLUMNS_FILE = 'columns.json'
+
+# rows densified and predicted at a time
+BATCH_SIZE = 65536
+
+
+def save_artifacts(path, model, engine, columns):
+    """Write the trained model, the fitted feature engine and the model input columns to a directory"""
+    os.makedirs(path, exist_ok=True)
+    model.save(os.path.join(path, MODEL_FILE))
+    engine.save(os.path.join(path, ENGINE_DIR))
+    with open(os.path.join(path, COLUMNS_FILE), 'w') as f:
+        json.dump(list(columns), f)
+
+
+def load_artifacts(path):
+    """Read the artifacts written by save_artifacts : (model, engine, columns)"""
+    import keras
+
+    model = keras.models.load_model(os.path.join(path, MODEL_FILE))
+    engine = FeatureEngine.load(os.path.join(path, ENGINE_DIR))
+    with open(os.path.join(path, COLUMNS_FILE)) as f:
+        columns = json.load(f)
+    return model, engine, columns
+
+
+def predict(model, X, batch_size=BATCH_SIZE):
+    """Model probability of every row of a design matrix, densified and predicted one large batch at a time"""
+    scores = np.empty(len(X.index), dtype=np.float32)
+    for start in range(0, len(scores), batch_size):
+        rows = slice(start, start + batch_size)
+        scores[rows] = model.predict(X.to_dense(rows), batch_size=batch_size, verbose=0).ravel()
+    return scores
+
+
+def rank_quarter(scores, index, quantile=0.1):
+    """Ranked long/short list: score, per date percentile rank, long = top quantile, short = bottom quantile"""
+    ranked = pd.DataFrame({'score': scores}, index=index)
+    ranked['rank_pct'] = pct_ranks(ranked, {'rank_pct': 'score'})['rank_pct']
+    ranked['side'] = np.where(ranked['rank_pct'] > 1 - quantile, 'long',
+                              np.where(ranked['rank_pct'] <= quantile, 'short', ''))
+    return ranked.sort_values('score', ascending=False)
+
+
+def score_quarter(path, new_quarter_rows, quantile=0.1, batch_size=BATCH_SIZE, save_state=False):
+    """Score newly landed raw compustat rows w/ the artifacts in path : (ranked list, timings in seconds)
+
+    save_state=True writes the engine's updated trailing state back, so the next quarter can be scored"""
+    timings = {}
+    start = time.perf_counter()
+    model, engine, columns = load_artifacts(path)
+    timings['load'] = time.perf_counter() - start
+
+    step = time.perf_counter()
+    X = engine.update_design(new_quarter_rows)
+    if X.dense_columns != columns:
+        raise ValueError('feature columns differ from the ones the model was trained on')
+    timings['features'] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    scores = predict(model, X, batch_size)
+    timings['score'] = time.perf_counter() - step
+
+    ranked = rank_quarter(scores, X.index, quantile)
+    if save_state:
+        engine.save(os.path.join(path, ENGINE_DIR))
+    timings['total'] = time.perf_counter() - start
+    return ranked, timings
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='score a new quarter of compustat rows w/ a saved model')
+    parser.add_argument('artifacts', help='directory written by save_artifacts')
+    parser.add_argument('filename', help='csv w/ the raw rows of the new quarter')
+    parser.add_argument('--quantile', type=float, default=0.1, help='fraction of the universe in the long and short lists')
+    parser.add_argument('--out', default=None, help='csv to write the ranked list to')
+    parser.add_argument('--save-state', action='store_true', help='keep the new quarter in the engine state')
+    args = parser.parse_args()
+
+    ranked, timings = score_quarter(args.artifacts, pd.read_csv(args.filename), args.quantile, save_state=args.save_state)
+    if args.out:
+        ranked.to_csv(args.out)
+    print(ranked[ranked['side'] != ''].to_string())
+    print(' '.join('{0} {1:.3f}s'.format(name, seconds) for name, seconds in timings.items()))
+    print('{0} rows, {1:.0f} rows/sec (features + scoring)'.format(
+        len(ranked), len(ranked) / max(timings['features'] + timings['score'], 1e-9)))
@@ -0,0 +1,72 @@
+"""Sliding-window sequences of (lookback quarters x features) per ticker for the RNN, as strided views of the feature array
+
+Only the windows of the batch being trained on are ever copied: the full set of overlapping windows
+would take lookback times the memory of the feature array."""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from feature_engine import quarter_number
+
+
+class SequenceDataset(object):
+    """Windows of `lookback` consecutive quarters of one ticker, labelled w/ the target of the last quarter
+
+    X is a design matrix (see design.py) sorted by (tic, date), y its targets (NaN = unknown, that
+    window is skipped). A window is only valid if its quarters are consecutive and of one ticker."""
+
+    def __init__(self, X, y, lookback=4, ends=None):
+        self.X = X
+        self.y = y
+        self.lookback = lookback
+        self.index = X.index
+
+        # dense float32 input once, every window is a view into it: (rows, features, lookback)
+        self.dense = X.to_dense()
+        self.windows = sliding_window_view(self.dense, lookback, axis=0)
+        if ends is None:
+            ends = self.valid_ends()
+        self.ends = ends
+
+    def valid_ends(self):
+        """Rows that end a window of `lookback` consecutive quarters of the same ticker w/ a known target"""
+        tic_codes = self.index.codes[self.index.names.index('tic')]
+        quarters = quarter_number(self.index)
+        ends = np.arange(self.lookback - 1, len(self.index))
+        starts = ends - self.lookback + 1
+        same_tic = tic_codes[starts] == tic_codes[ends]
+        consecutive = quarters[ends] - quarters[starts] == self.lookback - 1
+        return ends[same_tic & consecutive & ~np.isnan(self.y[ends])]
+
+    def __len__(self):
+        return len(self.ends)
+
+    def subset(self, mask):
+        """Dataset of the windows whose end rows are selected by a bool mask over the windows (e.g. a date range)"""
+        dataset = SequenceDataset.__new__(SequenceDataset)
+        dataset.__dict__.update(self.__dict__)
+        dataset.ends = self.ends[mask]
+        return dataset
+
+    def end_dates(self):
+        """Date of the last quarter of every window"""
+        return self.index.get_level_values('date')[self.ends]
+
+    def batch(self, positions):
+        """(batch, lookback, features) inputs and targets of the given windows, the only copy of window data"""
+        ends = self.ends[positions]
+        return np.swapaxes(self.windows[ends - self.lookback + 1], 1, 2), self.y[ends]
+
+    def batches(self, batch_size=32, shuffle=True, seed=0, epochs=None):
+        """Generate (inputs, targets) batches lazily, reshuffled every epoch, forever unless epochs is given"""
+        rng = np.random.RandomState(seed)
+        epoch = 0
+        while epochs is None or epoch < epochs:
+            order = rng.permutation(len(self)) if shuffle else np.arange(len(self))
+            for start in range(0, len(order), batch_size):
+                yield self.batch(order[start:start + batch_size])
+            epoch += 1
+
+    def steps(self, batch_size=32):
+        """Number of batches per epoch"""
+        return -(-len(self) // batch_size)
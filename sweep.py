@@ -0,0 +1,193 @@
+"""Hyperparameter sweeps: sample model configs from a search space, train them in a process pool and prune the
+weak ones early by successive halving on the validation loss. Every trial and rung result is recorded in a
+local SQLite database, so an interrupted sweep resumes where it stopped."""
+
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+# values tried for every hyperparameter: lookback=1 is the MLP on single quarters, lookback>1 an LSTM
+# over that many quarters of each ticker
+SEARCH_SPACE = {'width': [50, 100, 200],
+                'depth': [1, 2, 3],
+                'learning_rate': [1e-4, 1e-3, 1e-2],
+                'batch_size': [32, 128, 512],
+                'lookback': [1, 4, 8]}
+
+# data of the sweep, set once per worker process by init_worker
+WORKER_DATA = {}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS trials (sweep TEXT, trial INTEGER, config TEXT, PRIMARY KEY (sweep, trial));
+CREATE TABLE IF NOT EXISTS results (sweep TEXT, trial INTEGER, rung INTEGER, epochs INTEGER,
+                                    val_loss REAL, val_accuracy REAL, PRIMARY KEY (sweep, trial, rung));
+'''
+
+
+def sample_configs(space, n_trials, seed=0):
+    """n_trials distinct random configs from the search space (all of them if the space is smaller)"""
+    rng = np.random.RandomState(seed)
+    n_total = int(np.prod([len(values) for values in space.values()]))
+    configs, seen = [], set()
+    while len(configs) < min(n_trials, n_total):
+        config = {name: values[rng.randint(len(values))] for name, values in space.items()}
+        key = json.dumps(config, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            configs.append(config)
+    return configs
+
+
+def rung_budgets(min_epochs=1, max_epochs=9, eta=3):
+    """Epochs trained by the end of every rung of successive halving: min_epochs, min_epochs*eta, ... up to max_epochs"""
+    budgets = [min_epochs]
+    while budgets[-1] * eta <= max_epochs:
+        budgets.append(budgets[-1] * eta)
+    return budgets
+
+
+def init_worker(threads, X, y, train, validation):
+    """Process pool initializer: bound the threads of numpy / tensorflow and keep the sweep data once per worker
+
+    The workers fork from a parent that already loaded numpy, whose BLAS / OpenMP pools were sized
+    at import and ignore *_NUM_THREADS from here on, so they are limited through threadpoolctl.
+    tensorflow is only imported by the first trial and reads its thread counts from the environment."""
+    from threadpoolctl import threadpool_limits
+
+    WORKER_DATA['thread_limits'] = threadpool_limits(limits=threads)
+    for var in ('TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'):
+        os.environ[var] = str(threads)
+    WORKER_DATA.update(X=X, y=y, train=train, validation=validation)
+
+
+def worker_dataset(lookback):
+    """(train, validation) data of the worker for a lookback: dense arrays for the MLP, sequence datasets for the RNN"""
+    key = ('data', lookback)
+    if key not in WORKER_DATA:
+        X, y, train, validation = (WORKER_DATA[name] for name in ('X', 'y', 'train', 'validation'))
+        if lookback == 1:
+            WORKER_DATA[key] = ((X.to_dense(train), y[train]), (X.to_dense(validation), y[validation]))
+        else:
+            from sequences import SequenceDataset
+            sequences = SequenceDataset(X, y, lookback)
+            is_train = np.isin(sequences.ends, train)
+            is_validation = np.isin(sequences.ends, validation)
+            WORKER_DATA[key] = (sequences.subset(is_train), sequences.subset(is_validation))
+    return WORKER_DATA[key]
+
+
+def run_trial(config, epochs_done, budget, checkpoint):
+    """Train a trial from its checkpoint (if any) up to `budget` epochs, save it and score the validation quarters"""
+    import keras
+    from models import build_mlp, build_rnn
+
+    train, validation = worker_dataset(config['lookback'])
+    layers = (config['width'],) * config['depth']
+    if epochs_done and os.path.exists(checkpoint):
+        model = keras.models.load_model(checkpoint)
+    else:
+        epochs_done = 0
+        if config['lookback'] == 1:
+            model = build_mlp(train[0].shape[1], layers, learning_rate=config['learning_rate'])
+        else:
+            model = build_rnn(config['lookback'], train.dense.shape[1], layers, learning_rate=config['learning_rate'])
+
+    batch_size = config['batch_size']
+    if config['lookback'] == 1:
+        model.fit(train[0], train[1], batch_size=batch_size, initial_epoch=epochs_done, epochs=budget, verbose=0)
+        loss, acc = model.evaluate(validation[0], validation[1], batch_size=batch_size, verbose=0)
+    else:
+        model.fit(train.batches(batch_size), steps_per_epoch=train.steps(batch_size),
+                  initial_epoch=epochs_done, epochs=budget, verbose=0)
+        loss, acc = model.evaluate(validation.batches(batch_size, shuffle=False),
+                                   steps=validation.steps(batch_size), verbose=0)
+    model.save(checkpoint)
+    return {'val_loss': float(loss), 'val_accuracy': float(acc)}
+
+
+def time_split(X, y, validation_frac=0.2, gap=4):
+    """Row positions of the training and validation quarters: the last validation_frac of the quarters validate,
+    the gap quarters before them (whose labels look into the validation period) are left out"""
+    dates = X.index.get_level_values('date')
+    unique_dates = np.sort(dates.unique())
+    first_validation = int(len(unique_dates) * (1 - validation_frac))
+    labelled = ~np.isnan(y)
+    train = np.flatnonzero(labelled & (dates < unique_dates[max(first_validation - gap, 0)]))
+    validation = np.flatnonzero(labelled & (dates >= unique_dates[first_validation]))
+    return train, validation
+
+
+def sweep(X, y, name='sweep', space=SEARCH_SPACE, n_trials=27, db_path='sweep.sqlite', eta=3, min_epochs=1,
+          max_epochs=9, max_workers=None, threads_per_worker=1, validation_frac=0.2, gap=4, seed=0, trial_fn=run_trial):
+    """Successive halving sweep over a design matrix X and its targets y (NaN targets allowed, e.g. build_design(dropna=False))
+
+    Every rung trains the surviving trials up to the rung's epoch budget, then keeps the best 1/eta
+    by validation loss. Returns every recorded (trial, rung) result w/ its config"""
+    with closing(sqlite3.connect(db_path)) as db:
+        db.executescript(SCHEMA)
+        checkpoints = db_path + '.checkpoints'
+        os.makedirs(checkpoints, exist_ok=True)
+
+        # the sweep's trials: created once, read back on resume
+        rows = db.execute('SELECT trial, config FROM trials WHERE sweep = ? ORDER BY trial', (name,)).fetchall()
+        if not rows:
+            rows = [(trial, json.dumps(config)) for trial, config in enumerate(sample_configs(space, n_trials, seed))]
+            db.executemany('INSERT INTO trials VALUES (?, ?, ?)', [(name, trial, config) for trial, config in rows])
+            db.commit()
+        configs = {trial: json.loads(config) for trial, config in rows}
+
+        train, validation = time_split(X, y, validation_frac, gap)
+        survivors = sorted(configs)
+        budgets = rung_budgets(min_epochs, max_epochs, eta)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                 initargs=(threads_per_worker, X, y, train, validation)) as pool:
+            for rung, budget in enumerate(budgets):
+                done = set(trial for (trial,) in db.execute(
+                    'SELECT trial FROM results WHERE sweep = ? AND rung = ?', (name, rung)))
+                epochs_done = budgets[rung - 1] if rung else 0
+                futures = {pool.submit(trial_fn, configs[trial], epochs_done, budget,
+                                       os.path.join(checkpoints, '{0}_{1}.keras'.format(name, trial))): trial
+                           for trial in survivors if trial not in done}
+
+                # record every result as soon as it is in, so a crash loses at most the running trials
+                for future in as_completed(futures):
+                    result = future.result()
+                    db.execute('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                               (name, futures[future], rung, budget, result['val_loss'], result['val_accuracy']))
+                    db.commit()
+
+                # keep the best 1/eta of the rung
+                losses = dict(db.execute('SELECT trial, val_loss FROM results WHERE sweep = ? AND rung = ?', (name, rung)))
+                rank_loss = lambda trial: losses[trial] if np.isfinite(losses[trial]) else np.inf
+                survivors = sorted(survivors, key=rank_loss)[:max(1, len(survivors) // eta)]
+
+        results = pd.read_sql_query('SELECT * FROM results WHERE sweep = ? ORDER BY rung, val_loss', db, params=(name,))
+        config_frame = pd.DataFrame.from_dict(configs, orient='index').rename_axis('trial').reset_index()
+        return results.merge(config_frame, on='trial')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from data_cache import load_prepared
+    from feature_engine import FeatureEngine
+
+    parser = argparse.ArgumentParser(description='successive halving hyperparameter sweep on a compustat export')
+    parser.add_argument('filename')
+    parser.add_argument('--drop-cols', nargs='*', default=[])
+    parser.add_argument('--name', default='sweep')
+    parser.add_argument('--trials', type=int, default=27)
+    parser.add_argument('--db', default='sweep.sqlite')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    args = parser.parse_args()
+
+    X, y = FeatureEngine(args.drop_cols).build_design(load_prepared(args.filename, args.drop_cols), dropna=False)
+    results = sweep(X, y, args.name, n_trials=args.trials, db_path=args.db, max_workers=args.workers,
+                    threads_per_worker=args.threads_per_worker)
+    print(results[results['rung'] == results['rung'].max()].to_string(index=False))
@@ -0,0 +1,159 @@
+"""Deterministic synthetic compustat exports for scale testing: same header and column formats as
+s_and_p_A_ABBV_data.csv, any number of tickers and years, written in blocks of tickers so multi-GB
+files never have to be in memory
+
+Every ticker gets a fiscal year end (mostly december, else any month, so quarter end dates are
+irregular), some report on 52/53 week years (last saturday of the month instead of month end), enter
+and leave the universe at random quarters and miss the odd quarter. Fundamentals follow a per ticker
+random walk of firm size w/ noisy balance sheet / income ratios, prices a random walk, and items are
+missing at roughly the rates of the sample export (mibtq, prcraq, uaptq, teqq mostly)."""
+
+import gzip
+
+import numpy as np
+import pandas as pd
+
+# compustat export header, as in s_and_p_A_ABBV_data.csv
+COLUMNS = ['gvkey', 'datadate', 'fyearq', 'fqtr', 'indfmt', 'consol', 'popsrc', 'datafmt', 'tic', 'curcdq',
+           'datacqtr', 'datafqtr', 'actq', 'aoq', 'atq', 'cogsq', 'cshoq', 'dlcq', 'dlttq', 'dvpq', 'lctq',
+           'loq', 'ltq', 'mibtq', 'niq', 'oiadpq', 'ppegtq', 'prcraq', 'pstkq', 'rectq', 'revtq', 'saleq',
+           'teqq', 'uaptq', 'capxy', 'chechy', 'costat', 'prccq', 'prchq', 'prclq']
+
+# fraction of missing values per item (the price columns are missing together, see PRICE_COLS)
+MISSING = {'mibtq': 0.4, 'prcraq': 0.65, 'teqq': 0.5, 'uaptq': 0.97, 'ppegtq': 0.2,
+           'cogsq': 0.01, 'dlttq': 0.01, 'oiadpq': 0.01, 'prccq': 0.04}
+DEFAULT_MISSING = 0.002
+
+PRICE_COLS = ['prccq', 'prchq', 'prclq']
+
+# symbols read_csv parses as missing values
+NA_SYMBOLS = ('NA', 'NULL')
+
+# tickers generated (and written) at a time; the output depends on it, so it is fixed
+BLOCK_TICKERS = 1000
+
+
+def ticker_symbol(i):
+    """Unique symbol of ticker number i: A .. Z, AA .. ZZ, AAA .. (NA / NULL become NA.X / NULL.X)"""
+    letters = ''
+    i += 1
+    while i:
+        i, rest = divmod(i - 1, 26)
+        letters = chr(ord('A') + rest) + letters
+    return letters + '.X' if letters in NA_SYMBOLS else letters
+
+
+def last_saturday(year, month):
+    """Datetime index of the last saturday of every (year, month)"""
+    month_end = pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': 1})) + pd.offsets.MonthEnd(0)
+    return month_end - pd.to_timedelta((month_end.dt.dayofweek - 5) % 7, unit='D')
+
+
+def generate_block(block, n_tickers, start_year, n_years, seed=0):
+    """Raw rows of the tickers of block number `block` (BLOCK_TICKERS tickers each), sorted by gvkey and datadate"""
+    rng = np.random.RandomState([seed, block])
+    first = block * BLOCK_TICKERS
+    tickers = np.arange(first, min(first + BLOCK_TICKERS, n_tickers))
+    n, n_qtrs = len(tickers), n_years * 4
+
+    # per ticker: fiscal year end month, 52/53 week calendar, listed quarters [entry, leave)
+    fye_month = np.where(rng.uniform(size=n) < 0.7, 12, rng.randint(1, 13, n))
+    weekly = rng.uniform(size=n) < 0.1
+    entry = np.where(rng.uniform(size=n) < 0.6, 0, rng.randint(0, n_qtrs, n))
+    leave = np.where(rng.uniform(size=n) < 0.6, n_qtrs, entry + 1 + (rng.uniform(size=n) * (n_qtrs - entry)).astype(int))
+    qtr = np.arange(n_qtrs)
+    listed = (qtr >= entry[:, None]) & (qtr < leave[:, None]) & (rng.uniform(size=(n, n_qtrs)) >= 0.01)
+
+    # fiscal quarter end in every calendar quarter: the month of the quarter w/ month = fye_month (mod 3)
+    month0 = 3 * qtr[None, :] + (fye_month[:, None] - 1) % 3
+    fqtr = 4 - ((fye_month[:, None] - 1 - month0) % 12) // 3
+    fye_month0 = month0 + (4 - fqtr) * 3
+    fyearq = start_year + fye_month0 // 12 - (fye_month[:, None] <= 5)
+    # calendar quarter that holds most of the fiscal quarter
+    cqtr0 = month0 - 1
+
+    # firm size random walk, price random walk, noisy ratios of total assets
+    shape = (n, n_qtrs)
+    atq = np.exp(rng.normal(7, 1.5, n)[:, None] + np.cumsum(rng.normal(0.01, 0.05, shape), axis=1))
+    prccq = np.exp(rng.normal(3, 0.8, n)[:, None] + np.cumsum(rng.normal(0.02, 0.15, shape), axis=1))
+
+    def ratio(mean, sd=0.3):
+        return mean * np.exp(rng.normal(0, sd, n)[:, None] + rng.normal(0, sd / 3, shape))
+
+    revtq = atq * ratio(0.25)
+    margin = rng.normal(0.06, 0.05, n)[:, None] + rng.normal(0, 0.04, shape)
+    ltq = atq * np.minimum(ratio(0.6, 0.2), 0.98)
+    preferred = rng.uniform(size=n) < 0.15
+    values = {
+        'actq': atq * ratio(0.3), 'aoq': atq * ratio(0.1), 'atq': atq, 'cogsq': revtq * ratio(0.6, 0.15),
+        'cshoq': atq * ratio(0.5, 0.8) / prccq[:, :1], 'dlcq': atq * ratio(0.03, 0.8), 'dlttq': atq * ratio(0.25, 0.5),
+        'dvpq': np.where(preferred[:, None], atq * ratio(0.001), 0.0), 'lctq': atq * ratio(0.2),
+        'loq': atq * ratio(0.1), 'ltq': ltq, 'mibtq': np.where(rng.uniform(size=n)[:, None] < 0.5, 0.0, atq * ratio(0.01)),
+        'niq': revtq * margin, 'oiadpq': revtq * (margin + 0.04), 'ppegtq': atq * ratio(0.5),
+        'prcraq': prccq * ratio(1.0, 0.1), 'pstkq': np.where(preferred[:, None], atq * ratio(0.02), 0.0),
+        'rectq': atq * ratio(0.1), 'revtq': revtq, 'saleq': revtq, 'teqq': atq - ltq, 'uaptq': atq * ratio(0.01),
+        # year to date items: cumulative over the fiscal quarters
+        'capxy': atq * ratio(0.02) * fqtr, 'chechy': atq * rng.normal(0, 0.01, shape) * fqtr,
+        'prccq': prccq, 'prchq': prccq * np.exp(np.abs(rng.normal(0, 0.1, shape))),
+        'prclq': prccq * np.exp(-np.abs(rng.normal(0, 0.1, shape)))}
+
+    # missing items
+    for col, item in values.items():
+        if col in PRICE_COLS[1:]:
+            continue
+        missing = rng.uniform(size=shape) < MISSING.get(col, DEFAULT_MISSING)
+        for masked in (PRICE_COLS if col == 'prccq' else [col]):
+            values[masked] = np.where(missing, np.nan, values[masked])
+
+    # long format: listed (ticker, quarter) cells in ticker, date order
+    rows, cols = np.nonzero(listed)
+    year, month = start_year + month0[rows, cols] // 12, month0[rows, cols] % 12 + 1
+    month_end = pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': 1})) + pd.offsets.MonthEnd(0)
+    datadate = month_end.where(~weekly[rows], last_saturday(year, month))
+    df = pd.DataFrame({
+        'gvkey': ['{0:06d}'.format(1000 + 7 * i) for i in tickers[rows]],
+        'datadate': datadate.dt.strftime('%Y%m%d'),
+        'fyearq': fyearq[rows, cols], 'fqtr': fqtr[rows, cols],
+        'indfmt': 'INDL', 'consol': 'C', 'popsrc': 'D', 'datafmt': 'STD',
+        'tic': [ticker_symbol(i) for i in tickers[rows]], 'curcdq': 'USD',
+        'datacqtr': ['{0}Q{1}'.format(y, q) for y, q in zip(start_year + cqtr0[rows, cols] // 12,
+                                                              cqtr0[rows, cols] % 12 // 3 + 1)],
+        'datafqtr': ['{0}Q{1}'.format(y, q) for y, q in zip(fyearq[rows, cols], fqtr[rows, cols])]})
+    for col in COLUMNS[COLUMNS.index('actq'):]:
+        df[col] = 'A' if col == 'costat' else values[col][rows, cols]
+    # tickers that left the universe are inactive
+    df.loc[leave[rows] < n_qtrs, 'costat'] = 'I'
+    return df[COLUMNS]
+
+
+def iter_blocks(n_tickers, start_year=1990, n_years=30, seed=0):
+    """Yield the raw rows of the synthetic export, one block of tickers at a time"""
+    for block in range(-(-n_tickers // BLOCK_TICKERS)):
+        yield generate_block(block, n_tickers, start_year, n_years, seed)
+
+
+def write_compustat(filename, n_tickers, start_year=1990, n_years=30, seed=0):
+    """Write a synthetic export of n_tickers tickers over n_years years (gzipped if filename ends in .gz) : #rows
+
+    The same arguments always write the same file, block by block"""
+    n_rows = 0
+    with (gzip.open(filename, 'wt') if filename.endswith('.gz') else open(filename, 'w')) as f:
+        for n, df in enumerate(iter_blocks(n_tickers, start_year, n_years, seed)):
+            df.to_csv(f, header=n == 0, index=False, float_format='%.4f')
+            n_rows += len(df)
+    return n_rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='write a synthetic compustat shaped export')
+    parser.add_argument('filename')
+    parser.add_argument('--tickers', type=int, default=500)
+    parser.add_argument('--start-year', type=int, default=1990)
+    parser.add_argument('--years', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    n_rows = write_compustat(args.filename, args.tickers, args.start_year, args.years, args.seed)
+    print('{0} rows written to {1}'.format(n_rows, args.filename))
@@ -0,0 +1,130 @@
+"""Walk-forward (time-series) cross-validation: train the MLP on past quarters, score the next quarter, for every quarter
+
+Folds are independent so they run in a process pool, and every fold's result is cached under a hash
+of its training/test data and model config, so a rerun only retrains the folds whose data changed."""
+
+import hashlib
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+# default location of the per fold results
+CACHE_DIR = '.walk_forward_cache'
+
+
+def walk_forward_folds(dates, min_train=8, window=None, gap=4):
+    """(test date, train dates) of every fold, over the sorted unique dates
+
+    window=None trains on all earlier quarters (expanding), window=n on the last n (rolling).
+    gap leaves out the most recent quarters whose labels are not known yet at the test date:
+    a label looks `horizon` quarters ahead, so use gap=horizon to keep the training labels out of the future."""
+    dates = sorted(set(dates))
+    for i, test_date in enumerate(dates):
+        end = i - gap + 1
+        start = 0 if window is None else max(0, end - window)
+        if end - start >= min_train:
+            yield test_date, dates[start:end]
+
+
+def fold_key(X, y, train, test, config):
+    """Hash of a fold's training and test data and of the model config"""
+    sha = hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode())
+    for rows in (train, test):
+        sha.update(np.ascontiguousarray(X.features[rows]).tobytes())
+        sha.update(np.ascontiguousarray(X.mask[rows]).tobytes())
+        sha.update(np.ascontiguousarray(y[rows]).tobytes())
+    return sha.hexdigest()
+
+
+def run_fold(X_train, y_train, X_test, y_test, config, seed=0):
+    """Train the MLP on one fold and score its test quarter : dict of metrics and test predictions"""
+    # keras is only imported in the worker processes
+    import tensorflow as tf
+    from models import train_mlp
+
+    tf.random.set_seed(seed)
+    np.random.seed(seed)
+    model, history = train_mlp(X_train, y_train, config)
+    loss, acc = model.evaluate(X_test, y_test, verbose=0)
+    predictions = model.predict(X_test, verbose=0).ravel()
+    return {'loss': float(loss), 'accuracy': float(acc), 'epochs': len(history.history['loss']),
+            'predictions': predictions.tolist()}
+
+
+def save_done(in_flight, done):
+    """Write the results of the finished futures to their cache files and drop them from in_flight"""
+    for future in done:
+        with open(in_flight.pop(future), 'w') as f:
+            json.dump(future.result(), f)
+
+
+def walk_forward(X, y, config=None, min_train=8, window=None, gap=4, max_workers=None,
+                 cache_dir=CACHE_DIR, fold_fn=run_fold):
+    """Walk-forward backtest of a design matrix X (see design.py) and its targets y
+
+    Returns the per fold results (test date, #train/#test rows, test loss and accuracy) and the
+    out-of-sample predictions of every scored (tic, date) row"""
+    config = config or {}
+    dates = X.index.get_level_values('date')
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # every fold: rows in date order (so keras validates on the latest training quarters), cached or to run
+    folds = []
+    for test_date, train_dates in walk_forward_folds(dates, min_train, window, gap):
+        train = np.flatnonzero(dates.isin(train_dates))
+        train = train[np.argsort(dates[train], kind='stable')]
+        test = np.flatnonzero(dates == test_date)
+        path = os.path.join(cache_dir, fold_key(X, y, train, test, config) + '.json')
+        folds.append((test_date, train, test, path))
+    pending = [fold for fold in folds if not os.path.exists(fold[3])]
+
+    # train the folds that are not cached yet in parallel, w/ at most 2 folds per worker
+    # materialized at a time so the dense copies of every fold are never in memory together
+    if pending:
+        n_workers = max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            in_flight = {}
+            for test_date, train, test, path in pending:
+                if len(in_flight) >= 2 * n_workers:
+                    save_done(in_flight, wait(in_flight, return_when=FIRST_COMPLETED).done)
+                future = pool.submit(fold_fn, X.to_dense(train), y[train], X.to_dense(test), y[test], config)
+                in_flight[future] = path
+            save_done(in_flight, list(in_flight))
+    pending = set(fold[3] for fold in pending)
+
+    results, predictions = [], []
+    for test_date, train, test, path in folds:
+        with open(path) as f:
+            fold = json.load(f)
+        results.append({'test_date': test_date, 'n_train': len(train), 'n_test': len(test),
+                        'loss': fold['loss'], 'accuracy': fold['accuracy'], 'cached': path not in pending})
+        predictions.append(pd.Series(fold['predictions'], index=X.index[test]))
+    predictions = pd.concat(predictions).sort_index() if predictions else pd.Series(dtype=float)
+    columns = ['test_date', 'n_train', 'n_test', 'loss', 'accuracy', 'cached']
+    return pd.DataFrame(results, columns=columns), predictions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from data_cache import load_prepared
+    from feature_engine import FeatureEngine
+
+    parser = argparse.ArgumentParser(description='walk-forward backtest of the MLP on a compustat export')
+    parser.add_argument('filename')
+    parser.add_argument('--drop-cols', nargs='*', default=[])
+    parser.add_argument('--layers', nargs='+', type=int, default=[200, 200, 100])
+    parser.add_argument('--window', type=int, default=None, help='rolling window in quarters (default: expanding)')
+    parser.add_argument('--min-train', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    X, y = FeatureEngine(args.drop_cols).build_design(load_prepared(args.filename, args.drop_cols))
+    results, predictions = walk_forward(X, y, {'layers': tuple(args.layers)}, args.min_train, args.window,
+                                        max_workers=args.workers)
+    print(results.to_string(index=False))
+    print('mean accuracy {0:.4f}, {1} of {2} folds cached'.format(
+        results['accuracy'].mean(), results['cached'].sum(), len(results)))